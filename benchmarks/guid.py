@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Micro benchmark of the GUID generation in ChangeEntry.asDict.
+#
+# Compares the former implementation (json.dumps of every row) with the
+# modes "compat" and "fast" and checks that "compat" gives the same GUIDs.
+#
+# Usage: python benchmarks/guid.py [entries] [repeat]
+#
+# @author Lukas Schreiner
+# @file benchmarks/guid.py
+
+import os
+import sys
+import json
+import uuid
+import random
+import hashlib
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from planparser.basic import ChangeEntry, TimeFrame
+
+def legacyAsDict(ce):
+	"""The implementation before the GUID parts were introduced."""
+	entries = []
+	if len(ce._course) == 0:
+		ce._course.append(None)
+
+	for day in ce._dates:
+		for cour in ce._course:
+			for tf in ce._hours:
+				e = {
+					'type': ce._planType,
+					'date': day,
+					'hour': tf.hour,
+					'starttime': ce._startTime if tf.start is None else tf.start,
+					'endtime': ce._endTime if tf.end is None else tf.end,
+					'courseRef': ce._courseRef,
+					'teacher': str(ce._teacher) if ce._teacher is not None else None,
+					'subject': ce._subject,
+					'room': ce._room,
+					'chgType': ce._chgType,
+					'course': str(cour) if cour is not None else None,
+					'chgteacher': str(ce._changeTeacher) if ce._changeTeacher is not None else None,
+					'chgsubject': ce._changeSubject,
+					'chgroom': ce._changeRoom,
+					'notes': ce._note,
+					'info': ce._info
+				}
+				e['guid'] = str(uuid.UUID(hashlib.blake2s(json.dumps(e).encode('utf-8'), digest_size=16).hexdigest()))
+				entries.append(e)
+
+	return entries
+
+def createEntries(count, seed=1):
+	rnd = random.Random(seed)
+	entries = []
+	for i in range(count):
+		dates = ['{:02d}.10.2026'.format(d) for d in rnd.sample(range(1, 29), rnd.randint(1, 5))]
+		ce = ChangeEntry(dates, 32, rnd.choice([0, ChangeEntry.CHANGE_TYPE_TEACHER, ChangeEntry.CHANGE_TYPE_ROOM]))
+		for h in range(rnd.randint(1, 4)):
+			ce._hours.append(TimeFrame(h + 1, '{:02d}4500'.format(7 + h), '{:02d}3000'.format(8 + h)))
+		ce._course = ['{:02d}A'.format(rnd.randrange(40)) for c in range(rnd.randint(0, 3))]
+		ce._courseRef = 'CR{:d}'.format(i)
+		ce._teacher = 'TE{:02d}'.format(rnd.randrange(80))
+		ce._subject = 'SU{:d}'.format(rnd.randrange(30))
+		ce._room = 'R{:03d}'.format(rnd.randrange(50))
+		if rnd.random() < 0.3:
+			ce._changeTeacher = 'TE{:02d}'.format(rnd.randrange(80))
+			ce._note = 'Vertretung für Überstunden'
+		entries.append(ce)
+
+	return entries
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+	repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	entries = createEntries(count)
+	rows = sum([len(legacyAsDict(ce)) for ce in entries])
+
+	legacy = [e for ce in entries for e in legacyAsDict(ce)]
+	compat = [e for ce in entries for e in ce.asDict('compat')]
+	fast = [e for ce in entries for e in ce.asDict('fast')]
+	if legacy != compat:
+		print('ERROR: mode "compat" does not give the same rows/GUIDs!')
+		sys.exit(1)
+	if len(set([e['guid'] for e in fast]) ^ set([e['guid'] for e in legacy])) == 0:
+		print('ERROR: mode "fast" gives the GUIDs of mode "compat"!')
+		sys.exit(1)
+
+	print('{:d} entries, {:d} rows, best of {:d}:'.format(count, rows, repeat))
+	results = {}
+	for name, func in [
+		('legacy', lambda: [legacyAsDict(ce) for ce in entries]),
+		('compat', lambda: [ce.asDict('compat') for ce in entries]),
+		('fast', lambda: [ce.asDict('fast') for ce in entries])
+	]:
+		results[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+		print('  {:8s} {:8.1f} ms  {:6.2f} us/row  x{:.2f}'.format(
+			name, results[name] * 1000, results[name] * 1e6 / rows, results['legacy'] / results[name]
+		))
+
+if __name__ == '__main__':
+	main()
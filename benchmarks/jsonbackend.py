@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Benchmark of the JSON backend (planparser.jsonbackend) against the json
+# module of the standard library on a generated DaVinci export: loading the
+# export, serializing the parsed result and streaming it (payload.JSONStream).
+#
+# Usage: python benchmarks/jsonbackend.py [lessons] [repeat]
+#
+# @author Lukas Schreiner
+# @file benchmarks/jsonbackend.py
+
+import os
+import sys
+import json
+import random
+import tempfile
+import timeit
+import configparser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import payload
+from planparser import jsonbackend
+from planparser.worker import parseFile, configToDict
+
+def createExport(lessons, seed=1):
+	"""Returns a DaVinci export (JSON) with the given number of lessons."""
+	rnd = random.Random(seed)
+	classes = [{'id': 'C{:d}'.format(i), 'code': '{:02d}A'.format(i), 'description': 'Klasse {:d}'.format(i)} for i in range(40)]
+	teachers = [{'id': 'T{:d}'.format(i), 'code': 'TE{:02d}'.format(i), 'firstName': 'Vorname', 'lastName': 'Müller {:d}'.format(i)} for i in range(80)]
+	subjects = [{'id': 'S{:d}'.format(i), 'code': 'SU{:d}'.format(i), 'description': 'Fach {:d}'.format(i)} for i in range(30)]
+	rooms = [{'id': 'R{:d}'.format(i), 'code': 'R{:03d}'.format(i), 'description': 'Raum {:d}'.format(i)} for i in range(50)]
+	slots = [
+		{'label': str(h + 1), 'startTime': '{:02d}45'.format(7 + h), 'endTime': '{:02d}30'.format(8 + h)} for h in range(10)
+	]
+	duty = [
+		{'label': str(h + 1), 'startTime': '{:02d}30'.format(8 + h), 'endTime': '{:02d}45'.format(8 + h)} for h in range(9)
+	]
+	lessonTimes = []
+	for i in range(lessons):
+		slot = rnd.choice(slots)
+		lesson = {
+			'lessonRef': 'L{:d}'.format(i),
+			'courseRef': 'CR{:d}'.format(i),
+			'dates': ['202610{:02d}'.format(rnd.randint(1, 28))],
+			'startTime': slot['startTime'],
+			'endTime': slot['endTime'],
+			'subjectCode': rnd.choice(subjects)['code'],
+			'classCodes': [rnd.choice(classes)['code']],
+			'teacherCodes': [rnd.choice(teachers)['code']],
+			'roomCodes': [rnd.choice(rooms)['code']]
+		}
+		if rnd.random() < 0.3:
+			lesson['changes'] = {
+				'changeType': 1,
+				'newTeacherCodes': [rnd.choice(teachers)['code']],
+				'caption': 'Vertretung'
+			}
+		lessonTimes.append(lesson)
+
+	return {
+		'result': {
+			'teams': [],
+			'classes': classes,
+			'teachers': teachers,
+			'subjects': subjects,
+			'rooms': rooms,
+			'timeframes': [
+				{'code': 'Standard', 'timeslots': slots},
+				{'code': 'Aufsichten', 'timeslots': duty}
+			],
+			'displaySchedule': {'lessonTimes': lessonTimes}
+		}
+	}
+
+def main():
+	lessons = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+	repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	export = json.dumps(createExport(lessons)).encode('utf-8')
+
+	config = configparser.ConfigParser()
+	config.read(os.path.join(ROOT, 'config.ini.sample'), encoding='utf-8')
+	with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+		f.write(export)
+	try:
+		table, messages = parseFile('planparser.davinci', configToDict(config), f.name)
+	finally:
+		os.remove(f.name)
+
+	print('backend: {:s}, {:d} lessons, export {:d} KiB, {:d} rows, best of {:d}:'.format(
+		jsonbackend.BACKEND, lessons, len(export) // 1024, len(table['plan']), repeat
+	))
+	for name, stdlib, backend in [
+		('load export', lambda: json.loads(export.decode('utf-8')), lambda: jsonbackend.loads(export)),
+		# the master data sections are jsonbackend.Encoded.
+		('dump result', lambda: json.dumps(table, default=lambda o: o.value).encode('utf-8'), lambda: jsonbackend.dumps(table)),
+		('stream result', None, lambda: sum([len(c) for c in payload.JSONStream(table)]))
+	]:
+		backendTime = min(timeit.repeat(backend, number=1, repeat=repeat))
+		if stdlib is None:
+			print('  {:14s}            {:8.2f} ms'.format(name, backendTime * 1000))
+			continue
+
+		stdlibTime = min(timeit.repeat(stdlib, number=1, repeat=repeat))
+		print('  {:14s} json {:8.2f} ms  {:s} {:8.2f} ms  x{:.2f}'.format(
+			name, stdlibTime * 1000, jsonbackend.BACKEND, backendTime * 1000, stdlibTime / backendTime
+		))
+
+if __name__ == '__main__':
+	main()
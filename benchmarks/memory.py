@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Memory benchmark of the data model of the parsers (__slots__).
+#
+# Parses a generated Untis export with the classes as they are ("slots")
+# and with copies of them which have a __dict__ per instance like before
+# ("dict"). Every variant runs in its own process and reports the peak RSS.
+#
+# Usage: python benchmarks/memory.py [lessons] [weeks]
+#
+# @author Lukas Schreiner
+# @file benchmarks/memory.py
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import resource
+import subprocess
+import configparser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from planparser import basic
+from planparser import untis
+from planparser.worker import parseFile, configToDict
+
+def createExport(path, lessons, seed=1):
+	"""Writes an Untis export with the given number of lessons into path."""
+	rnd = random.Random(seed)
+	classes = ['{:02d}{:s}'.format(i // 4 + 5, 'abcd'[i % 4]) for i in range(40)]
+	teachers = ['TE{:02d}'.format(i) for i in range(80)]
+	subjects = ['SU{:d}'.format(i) for i in range(30)]
+	rooms = ['R{:03d}'.format(i) for i in range(50)]
+	start = time.localtime()
+
+	def write(name, rows):
+		with open(os.path.join(path, name), 'w', encoding='iso-8859-1', newline='') as f:
+			for row in rows:
+				f.write('\t'.join([str(c) for c in row]) + '\r\n')
+
+	write('date.txt', [[1, 'Mo', time.strftime('%Y%m%d', start), 1]])
+	write('time.txt', [
+		[wd, h, '', '{:02d}00'.format(7 + h), '{:02d}45'.format(7 + h)] for wd in range(1, 6) for h in range(1, 10)
+	])
+	write('class.txt', [[c, 'Klasse {:s}'.format(c)] for c in classes])
+	write('room.txt', [[r, 'Raum {:s}'.format(r)] for r in rooms])
+	write('subject.txt', [[s, 'Fach {:s}'.format(s)] for s in subjects])
+	write('teacher.txt', [[t, 'Vorname', '', 'Müller {:s}'.format(t)] for t in teachers])
+	write('lesson.txt', [
+		[
+			rnd.choice(teachers), rnd.randint(1, 5), rnd.randint(1, 9), rnd.choice(subjects), rnd.choice(rooms),
+			i, 0, rnd.choice(classes), ''.join([rnd.choice('1111111110x') for w in range(53)]), i
+		] for i in range(lessons)
+	])
+	write('substitution.txt', [])
+	write('supervision.txt', [
+		[time.strftime('%Y%m%d', start), h, 'Hof {:d}'.format(h % 3), rnd.choice(teachers), rnd.choice(teachers), 1]
+		for h in range(1, 9) for i in range(10)
+	])
+
+def withoutSlots(cls, bases=(object,)):
+	"""Returns a copy of the class with a __dict__ per instance."""
+	slots = cls.__dict__.get('__slots__', ())
+	namespace = dict([(k, v) for k, v in cls.__dict__.items() if k not in slots and k != '__slots__'])
+	return type(cls.__name__, bases, namespace)
+
+def useDictClasses():
+	basic.ChangeEntry = untis.ChangeEntry = withoutSlots(basic.ChangeEntry)
+	baseTimeFrame = withoutSlots(basic.TimeFrame)
+	untis.TimeFrame = withoutSlots(untis.TimeFrame, (baseTimeFrame,))
+	basic.TimeFrame = baseTimeFrame
+	for name in ['Teacher', 'Subject', 'Room', 'SchoolClass']:
+		base = withoutSlots(getattr(basic, name))
+		setattr(untis, name, withoutSlots(getattr(untis, name), (base,)))
+		setattr(basic, name, base)
+	for name in ['PlanDate', 'Lesson', 'Substitution', 'Supervision']:
+		setattr(untis, name, withoutSlots(getattr(untis, name)))
+
+def run(variant, lessons, weeks):
+	"""Parses the export in this process and prints peak RSS (KiB), time and entries."""
+	if variant == 'dict':
+		useDictClasses()
+
+	config = configparser.ConfigParser()
+	config.read(os.path.join(ROOT, 'config.ini.sample'), encoding='utf-8')
+	config.set('parser-untis', 'weeks', str(weeks))
+	path = tempfile.mkdtemp()
+	try:
+		createExport(path, lessons)
+		started = time.perf_counter()
+		table, messages = parseFile('planparser.untis', configToDict(config), os.path.join(path, 'lesson.txt'))
+		duration = time.perf_counter() - started
+	finally:
+		shutil.rmtree(path)
+
+	print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, duration, len(table['plan']))
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] == '--run':
+		run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+		return
+
+	lessons = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	weeks = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+	# the baseline without parsing (interpreter, PyQt5, ...).
+	baseline = int(subprocess.check_output([
+		sys.executable, '-c',
+		'import resource, planparser.untis; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+	], cwd=ROOT))
+	print('{:d} lessons, {:d} weeks, peak RSS without parsing {:.1f} MiB:'.format(lessons, weeks, baseline / 1024))
+	results = {}
+	for variant in ['dict', 'slots']:
+		output = subprocess.check_output([
+			sys.executable, os.path.abspath(__file__), '--run', variant, str(lessons), str(weeks)
+		])
+		rss, duration, rows = output.split()[-3:]
+		results[variant] = int(rss) - baseline
+		print('  {:6s} peak RSS {:8.1f} MiB (+{:7.1f} MiB)  {:7.2f} s  {:d} rows  x{:.2f}'.format(
+			variant, int(rss) / 1024, results[variant] / 1024, float(duration), int(rows),
+			results['dict'] / results[variant]
+		))
+
+if __name__ == '__main__':
+	main()
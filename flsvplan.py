@@ -11,29 +11,40 @@ __all__ = []
 __version__ = '4.36.1'
 __author__ = 'Lukas Schreiner'
 
-import urllib.parse
 import urllib.error
 import traceback
 import sys
 import os
 import os.path
-import json
-import base64
 import configparser
 import shutil
 import pickle
+import sqlite3
+import multiprocessing
+import queue
+import time
 import requests
 import glob
-from requests.auth import HTTPBasicAuth
 from threading import Thread
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from PyQt5.QtWidgets import QApplication, QSystemTrayIcon, QMenu
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 from PyQt5.QtGui import QIcon
-from searchplaner import SearchPlaner
+from searchplaner import createSearchPlaner
+from watchfile import DirectorySnapshot, StabilityTracker
+from journal import WatchJournal
+from workqueue import CoalescingQueue
+from uploader import Uploader
+from uploadstate import UploadState
+import payload
+from outbox import Outbox
+from resultarchive import ResultArchive
 from errorlog import ErrorDialog
 from planparser import getParser
 from planparser.untis import Parser as UntisParser
+from planparser.worker import ErrorLog, parseFile, configToDict
+from planparser import jsonbackend
 import sentry_sdk
 
 # absolute hack, but required for cx_Freeze to work properly.
@@ -43,21 +54,6 @@ if sys.platform == 'win32':
 APP = None
 APPQT = None
 
-class WatchFile(object):
-	"""A file which is or was watched in order to retrieve information"""
-
-	def __init__(self, path, fname):
-		self.path = path
-		self.name = fname
-
-		stInfo = os.stat(self.getFullName)
-		self.mtime = stInfo.st_mtime
-		self.atime = stInfo.st_atime
-
-	@property
-	def getFullName(self):
-		return '%s/%s' % (self.path, self.name)
-
 class Vertretungsplaner(QObject):
 	showDlg = pyqtSignal()
 	hideDlg = pyqtSignal()
@@ -82,6 +78,52 @@ class Vertretungsplaner(QObject):
 	def getIntervall(self):
 		return float(self.config.get("default", "intervall"))
 
+	def getWatcher(self):
+		return self.config.get('default', 'watcher', fallback='auto')
+
+	def getIgnorePatterns(self):
+		patterns = self.config.get('default', 'ignore', fallback='')
+		return [p.strip() for p in patterns.split(';') if p.strip()]
+
+	def useFingerprint(self):
+		return self.config.getboolean('options', 'fingerprint', fallback=True)
+
+	def isStreaming(self):
+		return self.config.getboolean('http', 'stream', fallback=False)
+
+	def serialize(self, table, uploader=None):
+		"""Returns the table encoded for the uploader (JSON as stream if streaming is enabled)."""
+		encoding = uploader.getEncoding() if uploader is not None else 'json'
+		if encoding != 'json':
+			return payload.encode(table, encoding)
+		elif self.isStreaming():
+			return payload.JSONStream(table)
+
+		return payload.dumps(table)
+
+	def getResultEncoding(self):
+		encoding = self.config.get('options', 'resultEncoding', fallback='json').lower()
+		if not payload.isEncodingAvailable(encoding):
+			print('Encoding "%s" is not available for saving the result - using json.' % (encoding,))
+			encoding = 'json'
+
+		return encoding
+
+	def getSettleTime(self):
+		return self.config.getfloat('default', 'settleTime', fallback=2.0)
+
+	def getWaitTimeout(self):
+		return self.config.getfloat('default', 'waitTimeout', fallback=10.0)
+
+	def getJournalFile(self):
+		return self.config.get('default', 'journal', fallback='vplan-journal.json')
+
+	def hasPendingFiles(self):
+		return self.stability.hasPending()
+
+	def takeSnapshot(self):
+		return DirectorySnapshot.scan(self.getWatchPath(), self.getIgnorePatterns())
+
 	def isProxyEnabled(self):
 		return self.config.getboolean('proxy', 'enable', fallback=False)
 
@@ -115,7 +157,7 @@ class Vertretungsplaner(QObject):
 		pathToWatch = self.getWatchPath()
 
 		try:
-			after = dict([(f, WatchFile(pathToWatch, f)) for f in os.listdir(pathToWatch)])
+			after = self.takeSnapshot()
 		except FileNotFoundError:
 			print('\nCould not poll directory %s (does not exist!)' % (pathToWatch,))
 			# try recreate the directory (maybe it does not exist in base path:
@@ -126,46 +168,24 @@ class Vertretungsplaner(QObject):
 			self.locked = False
 			return
 
-		added = [f for f in after if not f in self.before]
-		removed = [f for f in self.before if not f in after]
-		same = [f for f in after if f in self.before]
-		changed = [f for f in same if self.before[f].mtime != after[f].mtime]
+		added, removed, changed = after.compare(self.before, self.useFingerprint())
 
-		todo = added + changed
+		todo = self.getSettledFiles(after, added + changed)
 		if todo:
 			print("\nChanged/Added new Files: ", ", ".join(todo))
 			for f in todo:
 				f = f.strip()
 				handler = self.getHandler(f)
-				
+
 				if handler:
-					transName = '{}_{}_{}'.format(
-						datetime.now().strftime('%Y-%m-%dT%H%M%S'),
-						self.config.get('sentry', 'transPrefix', fallback='n'),
-						f.replace(' ', '_')
-					)
-					with sentry_sdk.start_transaction(op='parseUploadPlan', name=transName) as transaction:
-						try:
-							self.parsePlanByHandler(transaction, handler, f)
-						except Exception as e:
-							sentry_sdk.capture_exception(e)
-							self.showError(
-								'Neuer Vertretungsplan', 
-								'Vertretungsplan konnte nicht verarbeitet ' + \
-								'werden, weil die Datei fehlerhaft ist.'
-							)
-							print('Error: %s' % (str(e),))
-							traceback.print_exc()
-							self.dlg.addError(str(e))
-							#FIXME: self.showDlg.emit()
-							raise
-					print('Ending transaction {}'.format(transName))
-					transaction.finish()
-					# for untis, we parse only the first one!
-					if handler.onlyFirstFile():
-						break
+					self.enqueuePlan(after, handler, f)
 				else:
 					print('"%s" will be ignored.' % (f,))
+					self.recordFiles(after, None, f, WatchJournal.STATUS_IGNORED)
+
+			print('Queue: {depth:d} pending, {coalesced:d} coalesced, {processed:d} processed'.format(
+				**self.workQueue.stats()
+			))
 
 		if removed:
 			print("\nRemoved files: ", ", ".join(removed))
@@ -173,136 +193,586 @@ class Vertretungsplaner(QObject):
 		self.before = after
 		self.locked = False
 
+	def enqueuePlan(self, snapshot, handler, fileName):
+		# all files of a plan which consists of several files (untis) share one key.
+		key = handler.__module__ if handler.onlyFirstFile() else fileName
+		self.recordFiles(snapshot, handler, fileName, WatchJournal.STATUS_PENDING)
+		if self.workQueue.put(key, (snapshot, handler, fileName)):
+			print('"%s" replaces an older pending version.' % (fileName,))
+
+	def processQueue(self):
+		while self.getRun():
+			job = self.workQueue.get(self.getIntervall())
+			if job is None:
+				continue
+
+			jobs = [job]
+			if self.parsePool is not None:
+				# parse everything which is pending in parallel.
+				job = self.workQueue.get(0)
+				while job is not None:
+					jobs.append(job)
+					job = self.workQueue.get(0)
+
+			futures = []
+			for key, (snapshot, handler, fileName) in jobs:
+				absPath = os.path.join(self.getWatchPath(), fileName)
+				if self.parsePool is not None and os.path.exists(absPath):
+					futures.append(self.parsePool.submit(
+						parseFile, handler.__module__, configToDict(self.config), absPath
+					))
+				else:
+					futures.append(None)
+
+			parsed = []
+			for (key, (snapshot, handler, fileName)), future in zip(jobs, futures):
+				try:
+					absFile = self.processPlan(snapshot, handler, fileName, future)
+				except Exception:
+					# already reported - continue with the next one.
+					continue
+				if absFile is not None:
+					parsed.append(absFile)
+
+			# all files of the batch are read: now move them and save a backup.
+			# Also delete the older one (not while other files are parsed).
+			for absFile in parsed:
+				try:
+					self.moveAndDeleteVPlanFile(absFile)
+				except Exception as e:
+					sentry_sdk.capture_exception(e)
+					print('Error: %s' % (str(e),))
+					traceback.print_exc()
+					self.dlg.addError(str(e))
+
+	def processPlan(self, snapshot, handler, f, future=None):
+		if future is None and not os.path.exists(os.path.join(self.getWatchPath(), f)):
+			print('"%s" is gone - skipping.' % (f,))
+			return
+
+		transName = '{}_{}_{}'.format(
+			datetime.now().strftime('%Y-%m-%dT%H%M%S'),
+			self.config.get('sentry', 'transPrefix', fallback='n'),
+			f.replace(' ', '_')
+		)
+		# the transaction is finished by the upload worker.
+		transaction = sentry_sdk.start_transaction(op='parseUploadPlan', name=transName)
+		transaction.set_data('vplan.queue', self.workQueue.stats())
+		try:
+			data = self.parsePlanByHandler(transaction, handler, f, future)
+		except Exception as e:
+			self.recordFiles(snapshot, handler, f, WatchJournal.STATUS_FAILED)
+			sentry_sdk.capture_exception(e)
+			self.showError(
+				'Neuer Vertretungsplan', 
+				'Vertretungsplan konnte nicht verarbeitet ' + \
+				'werden, weil die Datei fehlerhaft ist.'
+			)
+			print('Error: %s' % (str(e),))
+			traceback.print_exc()
+			self.dlg.addError(str(e))
+			#FIXME: self.showDlg.emit()
+			transaction.finish()
+			raise
+
+		# blocks if the uploads fall behind.
+		if self.uploadQueue.full():
+			print('Upload queue is full - waiting for the upload worker.')
+		self.uploadQueue.put((transaction, snapshot, handler, f, data))
+
+		return data['system']['fname']
+
+	def processUploads(self):
+		while self.getRun():
+			try:
+				transaction, snapshot, handler, f, data = self.uploadQueue.get(timeout=self.getIntervall())
+			except queue.Empty:
+				continue
+
+			success = False
+			try:
+				with transaction.start_child(op='parse::sendPlan', description=f) as transChild:
+					success = self.sendPlan(
+						transChild, data,
+						handler=handler.__module__.rpartition('.')[2] if handler else None
+					)
+			except Exception as e:
+				sentry_sdk.capture_exception(e)
+				print('Error: %s' % (str(e),))
+				traceback.print_exc()
+				self.dlg.addError(str(e))
+			finally:
+				self.uploadQueue.task_done()
+
+			# something to show?
+			if self.dlg.hasData:
+				self.showDlg.emit()
+
+			print('Ending transaction {}'.format(transaction.name))
+			transaction.finish()
+			self.recordFiles(
+				snapshot, handler, f,
+				WatchJournal.STATUS_DONE if success else WatchJournal.STATUS_FAILED
+			)
+
+	def recordFiles(self, snapshot, handler, fileName, status):
+		"""Saves the status of the file (and the files belonging to its plan) in the journal."""
+		names = [fileName]
+		if handler:
+			names += [r for r in handler.requiredFiles() if r != fileName]
+
+		for name in names:
+			try:
+				self.journal.record(snapshot[name], status, self.useFingerprint())
+			except KeyError:
+				pass
+
+		try:
+			self.journal.save()
+		except OSError as e:
+			print('Could not save journal %s: %s' % (self.journal.fileName, str(e)))
+
+	def getSettledFiles(self, snapshot, candidates):
+		"""Returns the files which are completely written and can be parsed."""
+		ready = []
+		now = time.time()
+		for f in list(self.waitingSince.keys()):
+			if f not in snapshot:
+				del(self.waitingSince[f])
+
+		for f in self.stability.update(snapshot, candidates):
+			handler = self.getHandler(f)
+			if handler:
+				# a plan consisting of several files (untis) is only parsed once all are there.
+				missing = [
+					r for r in handler.requiredFiles() \
+					if r not in snapshot or not self.stability.isSettled(snapshot[r])
+				]
+				if missing and now - self.waitingSince.setdefault(f, now) > self.getWaitTimeout():
+					del(self.waitingSince[f])
+					print('"%s" waited too long for: %s - given up.' % (f, ', '.join(missing)))
+					self.recordFiles(snapshot, handler, f, WatchJournal.STATUS_FAILED)
+					self.showError(
+						'Neuer Vertretungsplan',
+						'Vertretungsplan konnte nicht verarbeitet werden, ' + \
+						'weil Dateien fehlen: {:s}'.format(', '.join(missing))
+					)
+					continue
+				elif missing:
+					print('"%s" waits for: %s' % (f, ', '.join(missing)))
+					self.stability.hold(snapshot[f])
+					continue
+
+			self.waitingSince.pop(f, None)
+			ready.append(f)
+
+		return ready
+
 	def initPlan(self):
 		pathToWatch = self.getWatchPath()
+		self.stability = StabilityTracker(self.getSettleTime())
+		self.journal = WatchJournal(self.getJournalFile())
 		try:
 			if not os.path.exists(pathToWatch):
 				os.makedirs(pathToWatch)
 
-			self.before = dict([(f, WatchFile(pathToWatch, f)) for f in os.listdir(pathToWatch)])
+			snapshot = self.takeSnapshot()
+			if self.journal.load():
+				# only files which were processed before are known. All others
+				# arrived while we were not running.
+				self.before = DirectorySnapshot(snapshot.path, snapshot.ignore)
+				for f, wf in snapshot.items():
+					if self.journal.isDone(wf, self.useFingerprint()):
+						self.before[f] = wf
+				pending = [f for f in snapshot if f not in self.before]
+				if pending:
+					print('\nFiles not processed yet: ', ', '.join(pending))
+				self.journal.prune(snapshot)
+			else:
+				# first start: everything there is treated as known.
+				self.before = snapshot
+				for wf in snapshot.values():
+					self.journal.record(wf, WatchJournal.STATUS_DONE, self.useFingerprint())
+				self.journal.save()
+
+			if self.useFingerprint():
+				self.before.fingerprintAll()
 		except FileNotFoundError:
 			print('\nCould not poll directory %s (does not exist!)' % (pathToWatch,))
-			self.before = {}
+			self.before = DirectorySnapshot(pathToWatch)
 
 		# Now start Looping
-		self.search = Thread(target=SearchPlaner, args=(self,)).start()
-
-	def sendPlan(self, transaction, table, absFile, planType='all'):
-		data = json.dumps(table).encode('utf-8')
+		self.worker = Thread(target=self.processQueue, daemon=True)
+		self.worker.start()
+		self.uploadWorker = Thread(target=self.processUploads, daemon=True)
+		self.uploadWorker.start()
+		self.outboxWorker = Thread(target=self.processOutbox, daemon=True)
+		self.outboxWorker.start()
+		self.search = Thread(target=createSearchPlaner, args=(self,)).start()
+
+	def sendPlan(self, transaction, table, planType='all', handler=None):
+		data = self.serialize(table)
+		errorMessage = None
+		fingerprint = payload.resultFingerprint(table) if planType == 'all' else None
 		# check what we need to do.
 		# 1st we need to save the data?
+		archived = None
 		if self.config.getboolean('options', 'saveResult'):
-			destFileName = os.path.join(
-				self.config.get('default', 'resultPath'),
-				'vplan-result-{:s}.json'.format(datetime.now().strftime('%Y-%m-%d_%H%M%S_%f'))
-			)
-			if not os.path.exists(os.path.dirname(destFileName)):
-				os.makedirs(os.path.dirname(destFileName))
-			with open(destFileName, 'wb') as f:
-				f.write('Type: {:s}\n'.format(planType).encode('utf-8'))
-				f.write(data)
+			encoding = self.getResultEncoding()
+			try:
+				# see resultreader.py
+				archived = self.resultArchive.put(
+					payload.encode(table, encoding) if encoding != 'json' else data,
+					planType, encoding, handler, fingerprint
+				)
+			except (OSError, sqlite3.Error) as e:
+				print('Could not save result in archive: %s' % (str(e),))
 
+		status = ResultArchive.STATUS_LOCAL
 		if self.config.getboolean('options', 'upload'):
-			data = base64.b64encode(data).decode('utf-8').replace('\n', '')
-			values = {
-				'apikey': base64.b64encode(self.getAPIKey().encode('utf-8')).decode('utf-8').replace('\n', ''),
-				'data': data,
-				'type': planType
-			}
-			values = urllib.parse.urlencode(values)
-
-			if self.getOption('debugOnline'):
-				values['XDEBUG_SESSION_START'] = '1'
-
-			proxies = None
-			if self.isProxyEnabled():
-				print('Proxy is activated')
-				httpproxy = "http://"+self.config.get("proxy", "phost")+":"+self.config.get("proxy", "pport")
-				proxies = {
-					"http" : httpproxy,
-					"https": httpproxy
-				}
-				transaction.set_data('http.proxy_uri', httpproxy)
-				transaction.set_tag('http.proxy', True)
+			transaction.set_data('vplan.fingerprint', fingerprint)
+			if len(self.uploaders) > 1:
+				# all targets get the same plan at the same time.
+				futures = [
+					self.uploadPool.submit(
+						self.sendToTarget, transaction, uploader, table, data, planType, fingerprint
+					) for uploader in self.uploaders
+				]
+				results = [f.result() for f in futures]
 			else:
-				print('Proxy is deactivated')
-				transaction.set_tag('http.proxy', False)
-			
-			headers = {}
-			httpauth = None
-			if self.config.has_option("siteauth", "enable") and self.config.get("siteauth", "enable") == 'True':
-				httpauth = HTTPBasicAuth(
-					self.config.get('siteauth', 'username'),
-					self.config.get('siteauth', 'password')
+				results = [
+					self.sendToTarget(transaction, self.uploaders[0], table, data, planType, fingerprint)
+				]
+
+			allSkipped = True
+			failed = 0
+			for uploader, (targetError, errObj, skipped, duration) in zip(self.uploaders, results):
+				transaction.set_data('vplan.target.{:s}'.format(uploader.name), {
+					'status': 'skipped' if skipped else ('error' if targetError else 'ok'),
+					'duration': duration
+				})
+				allSkipped = allSkipped and skipped
+				# any error to show in detail to user?
+				if targetError:
+					failed += 1
+					if len(self.uploaders) > 1:
+						targetError = (
+							'{:s} ({:s})'.format(targetError[0], uploader.name),
+							targetError[1]
+						)
+					errorMessage = targetError
+					transaction.set_data('vplan.send_error', targetError)
+					if errObj:
+						self.dlg.addData(str(errObj))
+					self.showError(*targetError)
+					self.dlg.addError(targetError[1])
+
+			if allSkipped:
+				self.showInfo(
+					'Vertretungsplan unverändert',
+					'Der Vertretungsplan hat sich nicht geändert und wurde nicht erneut hochgeladen.'
 				)
-				transaction.set_tag('http.basic_auth', True)
-			else:
-				transaction.set_tag('http.basic_auth', False)
+			elif errorMessage is None:
+				self.showInfo('Vertretungsplan hochgeladen', 'Die Datei wurde erfolgreich hochgeladen.')
 
-			# add post info
-			headers['Content-Type'] = 'application/x-www-form-urlencoded;charset=utf-8'
+			if allSkipped:
+				status = ResultArchive.STATUS_SKIPPED
+			elif failed == 0:
+				status = ResultArchive.STATUS_UPLOADED
+			elif failed < len(self.uploaders):
+				status = ResultArchive.STATUS_PARTIAL
+			else:
+				status = ResultArchive.STATUS_FAILED
 
-			errorMessage = None
-			errObj = None
+		if archived is not None:
 			try:
-				req = requests.post(self.getSendURL(), data=values, proxies=proxies, headers=headers, auth=httpauth)
-			except requests.exceptions.ConnectionError as err:
-				self.createCoreDump(err)
+				self.resultArchive.setStatus(archived, status)
+			except sqlite3.Error as e:
+				print('Could not update result archive: %s' % (str(e),))
+
+		return errorMessage is None
+
+	def sendToTarget(self, transaction, uploader, table, data, planType, fingerprint):
+		"""Uploads the plan to one target.
+
+		Returns the error message and object (if any), whether the upload was
+		skipped and how long it took.
+		"""
+		started = time.time()
+		endpoint = uploader.getURL()
+		with transaction.start_child(op='upload::target', description=uploader.name) as span:
+			httpproxy = uploader.getProxy()
+			if httpproxy:
+				print('Proxy is activated ({:s})'.format(uploader.name))
+				span.set_data('http.proxy_uri', httpproxy)
+				span.set_tag('http.proxy', True)
+			else:
+				print('Proxy is deactivated ({:s})'.format(uploader.name))
+				span.set_tag('http.proxy', False)
+			span.set_tag('http.basic_auth', uploader.getAuth() is not None)
+			span.set_data('http.timeout', uploader.getTimeout())
+
+			skipped = fingerprint is not None and uploader.skipUnchanged() and \
+				self.uploadState.isUnchanged(endpoint, fingerprint)
+			span.set_tag('vplan.upload_skipped', skipped)
+			if skipped:
+				print('Plan is unchanged since the last upload to {:s} - skipped.'.format(uploader.name))
+				# within the lock: processOutbox must not upload the older plan afterwards.
+				with uploader.lock:
+					self.outbox.discard(endpoint)
+				return None, None, True, time.time() - started
+
+			with uploader.lock:
+				errorMessage, errObj = self.uploadPlan(span, uploader, table, data, planType, fingerprint)
+				if errorMessage is None:
+					self.outbox.discard(endpoint)
+				elif planType == 'all':
+					# keep it and try again later.
+					try:
+						self.outbox.put(endpoint, planType, data, fingerprint)
+					except OSError as e:
+						print('Could not save plan in outbox: %s' % (str(e),))
+					else:
+						errorMessage = (
+							errorMessage[0],
+							errorMessage[1] + ' Das Hochladen wird automatisch erneut versucht.'
+						)
+
+		return errorMessage, errObj, False, time.time() - started
+
+	def getUploader(self, endpoint):
+		for uploader in self.uploaders:
+			if uploader.getURL() == endpoint:
+				return uploader
+
+		return None
+
+	def processOutbox(self):
+		"""Retries the uploads of the plans waiting in the outbox."""
+		while self.getRun():
+			time.sleep(self.getIntervall())
+			if not self.config.getboolean('options', 'upload'):
+				continue
+
+			for entry in self.outbox.due():
+				uploader = self.getUploader(entry.endpoint)
+				if uploader is None:
+					print('Upload target %s is not configured anymore - drop plan %s.' % (entry.endpoint, entry.id))
+					self.outbox.remove(entry)
+					continue
+
+				with uploader.lock:
+					# superseeded in the meantime?
+					if not self.outbox.exists(entry):
+						continue
+
+					print('Retry upload of plan %s (attempt %d).' % (entry.id, entry.attempts + 1))
+					with sentry_sdk.start_transaction(op='retryUpload', name=entry.id) as transaction:
+						transaction.set_data('vplan.outbox_attempts', entry.attempts)
+						try:
+							data = self.outbox.load(entry)
+							table = jsonbackend.loads(data)
+							if self.isStreaming():
+								data = self.outbox.stream(entry)
+						except (OSError, ValueError) as e:
+							print('Outbox entry %s is damaged: %s' % (entry.id, str(e)))
+							self.outbox.remove(entry)
+							continue
+
+						errorMessage, errObj = self.uploadPlan(
+							transaction, uploader, table, data, entry.planType, entry.fingerprint
+						)
+
+				if errorMessage is None:
+					self.outbox.remove(entry)
+					self.showInfo(
+						'Vertretungsplan hochgeladen', 
+						'Der zurückgehaltene Vertretungsplan wurde erfolgreich hochgeladen.'
+					)
+				else:
+					self.outbox.failed(entry)
+
+	def uploadPlan(self, transaction, uploader, table, data, planType='all', fingerprint=None):
+		"""Uploads the plan (as delta if possible) and returns the error (if any)."""
+		endpoint = uploader.getURL()
+		if planType == 'all' and uploader.useDelta() and \
+			self.uploadState.isDeltaAllowed(endpoint, *uploader.getDeltaFullPolicy()):
+			state = self.uploadState.get(endpoint)
+			delta = payload.buildDelta(table, state['guids'], state['hashes'])
+			transaction.set_data('vplan.delta', {'added': len(delta['added']), 'removed': len(delta['removed'])})
+			print('Sending delta: {:d} added, {:d} removed.'.format(len(delta['added']), len(delta['removed'])))
+			if uploader.getLayout() == 'columns':
+				delta = payload.withColumns(delta, 'added')
+			errorMessage, errObj = self.postPlan(transaction, uploader, self.serialize(delta, uploader), 'delta')
+			if errorMessage is None:
+				self.acknowledgePlan(endpoint, table, False, fingerprint, False)
+				return errorMessage, errObj
+
+			print('Delta upload failed - sending the complete plan.')
+
+		sendTable = table
+		if planType == 'all' and uploader.conditionalMasterData() and \
+			self.uploadState.isMasterDataKnown(endpoint, uploader.getMasterDataInterval()):
+			sendTable = payload.stripMasterData(table, self.uploadState.get(endpoint)['hashes'])
+			transaction.set_data('vplan.master_data_unchanged', sendTable['unchanged'])
+
+		shards = None
+		if planType == 'all' and uploader.getShardMode() != 'none':
+			shards = payload.splitPlan(sendTable, uploader.getShardMode(), uploader.getShardSize())
+
+		committed = True
+		if shards is not None and len(shards) > 1:
+			errorMessage, errObj, committed = self.postShards(
+				transaction, uploader, sendTable, shards, fingerprint
+			)
+		else:
+			if planType == 'all' and uploader.getLayout() == 'columns':
+				sendTable = payload.withColumns(sendTable)
+			if sendTable is not table or uploader.getEncoding() != 'json':
+				data = self.serialize(sendTable, uploader)
+			errorMessage, errObj = self.postPlan(transaction, uploader, data, planType)
+
+		if errorMessage is None and planType == 'all':
+			self.acknowledgePlan(endpoint, table, True, fingerprint, not sendTable.get('unchanged'))
+		elif errorMessage is not None and committed:
+			# we do not know what the server has now.
+			self.uploadState.reset(endpoint)
+			self.saveUploadState()
+
+		return errorMessage, errObj
+
+	def postShards(self, transaction, uploader, table, shards, fingerprint=None):
+		"""Uploads the plan shard by shard and completes the batch with a commit.
+
+		Shards which were sent before (same plan) are skipped, a failed shard
+		is retried on its own. Returns the error (if any) and whether the commit
+		was sent.
+		"""
+		endpoint = uploader.getURL()
+		batch = self.uploadState.getBatch(endpoint, fingerprint, len(shards))
+		transaction.set_data('vplan.batch', {
+			'id': batch['id'],
+			'shards': len(shards),
+			'resumed': len(batch['sent'])
+		})
+		print('Sending plan in {:d} shards (batch {:s}).'.format(len(shards), batch['id']))
+		for seq, entries in enumerate(shards):
+			if seq in batch['sent']:
+				continue
+
+			shard = payload.buildShard(batch['id'], seq, len(shards), entries)
+			if uploader.getLayout() == 'columns':
+				shard = payload.withColumns(shard)
+			data = self.serialize(shard, uploader)
+			for attempt in range(max(0, uploader.getShardRetries()) + 1):
+				errorMessage, errObj = self.postPlan(transaction, uploader, data, 'shard')
+				if errorMessage is None:
+					break
+
+				print('Upload of shard {:d}/{:d} failed (attempt {:d}).'.format(seq + 1, len(shards), attempt + 1))
+
+			if errorMessage is not None:
+				return errorMessage, errObj, False
+
+			self.uploadState.shardSent(endpoint, seq)
+			self.saveUploadState()
+
+		data = self.serialize(payload.buildCommit(table, batch['id'], len(shards)), uploader)
+		errorMessage, errObj = self.postPlan(transaction, uploader, data, 'commit')
+		return errorMessage, errObj, True
+
+	def acknowledgePlan(self, endpoint, table, full, fingerprint=None, masterData=True):
+		self.uploadState.acknowledge(endpoint, table, full, fingerprint, masterData)
+		self.saveUploadState()
+
+	@pyqtSlot()
+	def forceFullUpload(self):
+		"""Forgets what the servers acknowledged, so the next plan is sent completely."""
+		for uploader in self.uploaders:
+			self.uploadState.reset(uploader.getURL())
+		self.saveUploadState()
+		self.showInfo(
+			'Vollständiges Hochladen',
+			'Der nächste Vertretungsplan wird mit allen Stammdaten vollständig hochgeladen.'
+		)
+
+	def saveUploadState(self):
+		try:
+			self.uploadState.save()
+		except OSError as e:
+			print('Could not save upload state %s: %s' % (self.uploadState.fileName, str(e)))
+
+	def postPlan(self, transaction, uploader, data, planType):
+		errorMessage = None
+		errObj = None
+		values, headers = uploader.encodeBody(
+			data, planType, uploader.getAPIKey(), self.getOption('debugOnline'), uploader.getEncoding()
+		)
+		transaction.set_tag('http.format', uploader.getFormat())
+		transaction.set_tag('http.encoding', uploader.getEncoding())
+		if isinstance(data, bytes):
+			transaction.set_data('http.body_size', len(values))
+		else:
+			transaction.set_tag('http.streamed', True)
+		try:
+			req = uploader.post(uploader.getURL(), data=values, headers=headers)
+		except requests.exceptions.Timeout as err:
+			self.createCoreDump(err)
+			errorMessage = (
+				'Warnung',
+				'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. '
+				'Bitte kontaktieren Sie das Website-Team der FLS! '
+				'Der Server hat nicht rechtzeitig geantwortet.'
+			)
+			errObj = err
+			print('Zeitüberschreitung beim Hochladen: {:s}'.format(str(err)))
+			sentry_sdk.capture_exception(err)
+		except requests.exceptions.ConnectionError as err:
+			self.createCoreDump(err)
+			errorMessage = (
+				'Warnung',
+				'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. '
+				'Bitte kontaktieren Sie das Website-Team der FLS! '
+				'Beim Hochladen konnte keine Verbindung zum Server aufgebaut werden.'
+			)
+			errObj = err
+			print('HTTP-Fehler aufgetreten: {:s}'.format(str(err)))
+			sentry_sdk.capture_exception(err)
+		except urllib.error.URLError as err:
+			self.createCoreDump(err)
+			errorMessage = (
+				'Warnung',
+				'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. \
+				Bitte kontaktieren Sie das Website-Team der FLS!'
+			)
+			errObj = err
+			print('URL-Fehler aufgetreten: {:s}'.format(err.reason))
+			sentry_sdk.capture_exception(err)
+		except Exception as err:
+			self.createCoreDump(err)
+			errorMessage = (
+				'Warnung',
+				'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. \
+				Bitte kontaktieren Sie das Website-Team der FLS!'
+			)
+			errObj = err
+			print("Unbekannter Fehler aufgetreten: ", err)
+			sentry_sdk.capture_exception(err)
+		else:
+			transaction.set_tag('http.status_code', req.status_code)
+			transaction.set_data('http.text', req.text)
+			if req.status_code != 204:
 				errorMessage = (
 					'Warnung',
 					'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. '
-					'Bitte kontaktieren Sie das Website-Team der FLS! '
-					'Beim Hochladen konnte keine Verbindung zum Server aufgebaut werden.'
-				)
-				errObj = err
-				print('HTTP-Fehler aufgetreten: {:s}'.format(str(err)))
-				sentry_sdk.capture_exception(err)
-			except urllib.error.URLError as err:
-				self.createCoreDump(err)
-				errorMessasge = (
-					'Warnung',
-					'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. \
-					Bitte kontaktieren Sie das Website-Team der FLS!'
-				)
-				errObj = err
-				print('URL-Fehler aufgetreten: {:s}'.format(err.reason))
-				sentry_sdk.capture_exception(err)
-			except Exception as err:
-				self.createCoreDump(err)
-				errorMessage = (
-					'Warnung',
-					'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. \
-					Bitte kontaktieren Sie das Website-Team der FLS!'
+					'Es wurde ein abweichender Statuscode erhalten: {:d}'.format(req.status_code)
 				)
-				errObj = err
-				print("Unbekannter Fehler aufgetreten: ", err)
-				sentry_sdk.capture_exception(err)
-			else:
-				transaction.set_tag('http.status_code', req.status_code)
-				transaction.set_data('http.text', req.text)
-				if req.status_code != 204:
-					errorMessage = (
-						'Warnung',
-						'Der Vertretungsplan konnte eventuell nicht korrekt hochgeladen werden. '
-						'Es wurde ein abweichender Statuscode erhalten: {:d}'.format(req.status_code)
-					)
-					errObj = req.text
-				else:
-					print(req.text)
-					print('Erfolgreich hochgeladen.')
-			
-			# any error to show in detail to user?
-			if errorMessage:
-				transaction.set_data('vplan.send_error', errorMessage)
-				if errObj:
-					self.dlg.addData(str(errObj))
-				self.showError(*errorMessage)
-				self.dlg.addError(errorMessage[1])
+				errObj = req.text
 			else:
-				self.showInfo('Vertretungsplan hochgeladen', 'Die Datei wurde erfolgreich hochgeladen.')
+				print(req.text)
+				print('Erfolgreich hochgeladen.')
 
-		# now move the file and save an backup. Also delete the older one.
-		self.moveAndDeleteVPlanFile(absFile)
+		return errorMessage, errObj
 
 	def createCoreDump(self, err):
 		if not self.getOption('createCoreDump'):
@@ -387,10 +857,30 @@ class Vertretungsplaner(QObject):
 
 		self.lastFile = newFile
 
-	def parsePlanByHandler(self, transaction, hdl, fileName):
+	def parsePlanByHandler(self, transaction, hdl, fileName, future=None):
 		# send a notification
 		self.showInfo('Neuer Vertretungsplan', 'Es wurde eine neue Datei gefunden und wird jetzt verarbeitet.')
 		absPath = os.path.join(self.config.get('default', 'path'), fileName)
+		if future is not None:
+			# already parsed in the process pool.
+			with transaction.start_child(op='parse::pool', description=fileName):
+				data, messages = future.result()
+			self.planParserPrepared()
+			ErrorLog.replay(messages, self.dlg)
+		else:
+			data = self.parseLocal(transaction, hdl, absPath)
+
+		data['system'] = {
+			'version': __version__,
+			'handler': hdl.__name__,
+			'fname': absPath
+		}
+		self.showInfo('Neuer Vertretungsplan', 'Vertretungsplan wurde verarbeitet und wird nun hochgeladen.')
+
+		return data
+
+	def parseLocal(self, transaction, hdl, absPath):
+		fileName = os.path.basename(absPath)
 		djp = hdl(self.config, self.dlg, absPath)
 		djp.planFileLoaded.connect(self.planFileLoaded)
 		djp.planParserPrepared.connect(self.planParserPrepared)
@@ -406,20 +896,7 @@ class Vertretungsplaner(QObject):
 		with transaction.start_child(op='parse::postParse', description=fileName):
 			djp.postParse(transChild)
 		
-		data = djp.getResult()
-		data['system'] = {
-			'version': __version__,
-			'handler': hdl.__name__,
-			'fname': absPath
-		}
-		self.showInfo('Neuer Vertretungsplan', 'Vertretungsplan wurde verarbeitet und wird nun hochgeladen.')
-
-		with transaction.start_child(op='parse::sendPlan', description=fileName):
-			self.sendPlan(transChild, data, absPath)
-
-		# something to show?
-		if self.dlg.hasData:
-			self.showDlg.emit()
+		return djp.getResult()
 
 	@pyqtSlot()
 	def planFileLoaded(self):
@@ -439,12 +916,19 @@ class Vertretungsplaner(QObject):
 	def bye(self):
 		global APPQT
 		self.run = False
+		if self.parsePool is not None:
+			self.parsePool.shutdown(wait=False)
+		for uploader in self.uploaders:
+			uploader.close()
+		if self.uploadPool is not None:
+			self.uploadPool.shutdown(wait=False)
 		sys.exit(0)
 
 	def initTray(self):
 		self.tray = QSystemTrayIcon(QIcon('logo.ico'), self)
 		menu = QMenu('FLS Vertretungsplaner')
 		menu.addAction('Planer hochladen', self.getNewFiles)
+		menu.addAction('Nächsten Plan vollständig hochladen', self.forceFullUpload)
 		menu.addAction('Beenden', self.bye)
 		self.tray.setContextMenu(menu)
 		self.message.connect(self.tray.showMessage)
@@ -500,6 +984,21 @@ class Vertretungsplaner(QObject):
 		self.tray = None
 		self.search = None
 		self.before = None
+		self.stability = None
+		# files waiting for the other files of their plan (untis).
+		self.waitingSince = {}
+		self.journal = None
+		self.workQueue = CoalescingQueue()
+		self.worker = None
+		self.uploadQueue = None
+		self.uploadWorker = None
+		self.uploaders = []
+		self.uploadPool = None
+		self.uploadState = None
+		self.outbox = None
+		self.outboxWorker = None
+		self.resultArchive = None
+		self.parsePool = None
 		self.locked = False
 		self._sentryEnabled = False
 
@@ -509,6 +1008,27 @@ class Vertretungsplaner(QObject):
 
 		debugLog = self.config.getboolean('options', 'debugLogs', fallback=False)
 
+		self.uploadQueue = queue.Queue(self.config.getint('options', 'uploadQueue', fallback=2))
+		self.uploaders = Uploader.fromConfig(self.config)
+		if len(self.uploaders) > 1:
+			self.uploadPool = ThreadPoolExecutor(max_workers=len(self.uploaders))
+		self.uploadState = UploadState(self.config.get('default', 'uploadState', fallback='vplan-upload-state.json'))
+		self.uploadState.load()
+		self.outbox = Outbox(
+			self.config.get('default', 'outboxPath', fallback='outbox'),
+			self.config.getfloat('http', 'retryDelay', fallback=30.0),
+			self.config.getfloat('http', 'retryMaxDelay', fallback=3600.0)
+		)
+		self.resultArchive = ResultArchive(
+			self.config.get('default', 'resultPath', fallback='results'),
+			self.config.getint('options', 'resultKeep', fallback=500),
+			self.config.getfloat('options', 'resultMaxAge', fallback=30) * 86400,
+			self.config.getfloat('options', 'resultMaxSize', fallback=500) * 1024 * 1024
+		)
+		parseProcesses = self.config.getint('options', 'parseProcesses', fallback=0)
+		if parseProcesses > 0:
+			self.parsePool = ProcessPoolExecutor(max_workers=parseProcesses)
+
 		self.dlg = ErrorDialog(debugLog)
 		self.showDlg.connect(self.dlg.open)
 		self.hideDlg.connect(self.dlg.close)
@@ -516,6 +1036,8 @@ class Vertretungsplaner(QObject):
 		self.initPlan()
 
 if __name__ == '__main__':
+	# required for the parse processes in the frozen (cx_Freeze) version.
+	multiprocessing.freeze_support()
 	APPQT = QApplication(sys.argv)
 	APPQT.setQuitOnLastWindowClosed(False)
 	APP = Vertretungsplaner()
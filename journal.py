@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file journal.py
+
+import os
+import json
+import time
+import threading
+
+class WatchJournal(object):
+	"""On-disk journal of the files which were processed.
+
+	It is used on startup in order to process files which arrived while
+	the application was not running and to skip those already uploaded.
+	"""
+
+	STATUS_PENDING = 'pending'
+	STATUS_DONE = 'done'
+	STATUS_FAILED = 'failed'
+	STATUS_IGNORED = 'ignored'
+
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.entries = {}
+		self.loaded = False
+		self._lock = threading.Lock()
+
+	def load(self):
+		try:
+			with open(self.fileName, 'r', encoding='utf-8') as f:
+				self.entries = json.load(f)
+		except FileNotFoundError:
+			self.entries = {}
+			self.loaded = False
+		except ValueError as e:
+			print('Journal %s is damaged (%s) - start with an empty one.' % (self.fileName, str(e)))
+			self.entries = {}
+			self.loaded = True
+		else:
+			self.loaded = True
+
+		return self.loaded
+
+	def save(self):
+		with self._lock:
+			dirName = os.path.dirname(self.fileName)
+			if dirName and not os.path.exists(dirName):
+				os.makedirs(dirName)
+
+			tmpName = '{:s}.tmp'.format(self.fileName)
+			with open(tmpName, 'w', encoding='utf-8') as f:
+				json.dump(self.entries, f)
+			os.replace(tmpName, self.fileName)
+
+	def prune(self, names):
+		"""Removes all entries of files which do not exist anymore."""
+		with self._lock:
+			for name in list(self.entries.keys()):
+				if name not in names:
+					del(self.entries[name])
+
+	def record(self, wf, status, useFingerprint=True):
+		with self._lock:
+			self.entries[wf.name] = {
+				'size': wf.size,
+				'mtime': wf.mtime,
+				'hash': wf.fingerprint if useFingerprint else None,
+				'status': status,
+				'updated': int(time.time())
+			}
+
+	def getStatus(self, wf, useFingerprint=True):
+		"""Returns the recorded status if the entry matches the file version."""
+		try:
+			entry = self.entries[wf.name]
+		except KeyError:
+			return None
+
+		if entry['size'] != wf.size:
+			return None
+		elif entry['mtime'] != wf.mtime and \
+			(not useFingerprint or entry['hash'] is None or entry['hash'] != wf.fingerprint):
+			return None
+
+		return entry['status']
+
+	def isDone(self, wf, useFingerprint=True):
+		return self.getStatus(wf, useFingerprint) in [WatchJournal.STATUS_DONE, WatchJournal.STATUS_IGNORED]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file outbox.py
+
+import os
+import json
+import time
+import random
+import threading
+from datetime import datetime
+from payload import FileStream
+
+class OutboxEntry(object):
+	"""A plan waiting in the outbox for the next upload attempt."""
+
+	def __init__(self, entryId, endpoint, planType, fingerprint=None):
+		self.id = entryId
+		self.endpoint = endpoint
+		self.planType = planType
+		self.fingerprint = fingerprint
+		self.created = int(time.time())
+		self.attempts = 0
+		self.nextAttempt = 0
+
+	def toDict(self):
+		return {
+			'id': self.id,
+			'endpoint': self.endpoint,
+			'planType': self.planType,
+			'fingerprint': self.fingerprint,
+			'created': self.created,
+			'attempts': self.attempts,
+			'nextAttempt': self.nextAttempt
+		}
+
+	@classmethod
+	def fromDict(cls, data):
+		self = cls(data['id'], data['endpoint'], data['planType'], data.get('fingerprint'))
+		self.created = data['created']
+		self.attempts = data['attempts']
+		self.nextAttempt = data['nextAttempt']
+		return self
+
+class Outbox(object):
+	"""Persistent directory of plans which could not be uploaded.
+
+	Every entry consists of the serialized plan (<id>.json) and its
+	metadata (<id>.meta). Failed attempts are retried with exponential
+	backoff and jitter. Only the newest plan per endpoint is kept.
+	"""
+
+	def __init__(self, path, retryDelay=30.0, retryMaxDelay=3600.0):
+		self.path = path
+		self.retryDelay = retryDelay
+		self.retryMaxDelay = retryMaxDelay
+		self._lock = threading.Lock()
+
+	def _dataFile(self, entryId):
+		return os.path.join(self.path, '{:s}.json'.format(entryId))
+
+	def _metaFile(self, entryId):
+		return os.path.join(self.path, '{:s}.meta'.format(entryId))
+
+	def _writeMeta(self, entry):
+		tmpName = '{:s}.tmp'.format(self._metaFile(entry.id))
+		with open(tmpName, 'w', encoding='utf-8') as f:
+			json.dump(entry.toDict(), f)
+		os.replace(tmpName, self._metaFile(entry.id))
+
+	def entries(self):
+		result = []
+		try:
+			names = os.listdir(self.path)
+		except FileNotFoundError:
+			return result
+
+		for name in names:
+			if not name.endswith('.meta'):
+				continue
+			try:
+				with open(os.path.join(self.path, name), 'r', encoding='utf-8') as f:
+					result.append(OutboxEntry.fromDict(json.load(f)))
+			except (OSError, ValueError, KeyError) as e:
+				print('Ignore damaged outbox entry %s: %s' % (name, str(e)))
+
+		result.sort(key=lambda e: e.created)
+		return result
+
+	def put(self, endpoint, planType, data, fingerprint=None):
+		"""Saves the plan (bytes or a stream). Older plans for the same endpoint are dropped."""
+		with self._lock:
+			if not os.path.exists(self.path):
+				os.makedirs(self.path)
+
+			entryId = datetime.now().strftime('%Y%m%d%H%M%S%f')
+			entry = OutboxEntry(entryId, endpoint, planType, fingerprint)
+			entry.attempts = 1
+			entry.nextAttempt = time.time() + self.getDelay(entry.attempts)
+			with open(self._dataFile(entryId), 'wb') as f:
+				if isinstance(data, bytes):
+					f.write(data)
+				else:
+					data.writeTo(f)
+			self._writeMeta(entry)
+
+		self.discard(endpoint, keep=entryId)
+		return entry
+
+	def load(self, entry):
+		with open(self._dataFile(entry.id), 'rb') as f:
+			return f.read()
+
+	def stream(self, entry):
+		return FileStream(self._dataFile(entry.id))
+
+	def exists(self, entry):
+		return os.path.exists(self._metaFile(entry.id))
+
+	def remove(self, entry):
+		with self._lock:
+			for fileName in [self._metaFile(entry.id), self._dataFile(entry.id)]:
+				try:
+					os.remove(fileName)
+				except FileNotFoundError:
+					pass
+
+	def discard(self, endpoint, keep=None):
+		"""Drops all entries of the endpoint (e.g. because a newer plan was uploaded)."""
+		for entry in self.entries():
+			if entry.endpoint == endpoint and entry.id != keep:
+				print('Drop outdated plan %s from outbox.' % (entry.id,))
+				self.remove(entry)
+
+	def getDelay(self, attempts):
+		delay = min(self.retryMaxDelay, self.retryDelay * (2 ** max(0, attempts - 1)))
+		# jitter, so not all clients retry at the same time.
+		return delay * random.uniform(0.5, 1.5)
+
+	def failed(self, entry):
+		with self._lock:
+			entry.attempts += 1
+			entry.nextAttempt = time.time() + self.getDelay(entry.attempts)
+			if os.path.exists(self._metaFile(entry.id)):
+				self._writeMeta(entry)
+
+	def due(self, now=None):
+		now = time.time() if now is None else now
+		return [e for e in self.entries() if e.nextAttempt <= now]
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Builds the different variants of the upload payload out of the parser result.
+#
+# @author Lukas Schreiner
+# @file payload.py
+
+import hashlib
+from itertools import groupby
+from operator import itemgetter
+from planparser import jsonbackend
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+try:
+	import cbor2
+except ImportError:
+	cbor2 = None
+
+# master data section of the result => keys in "hashes"
+MASTER_DATA = {
+	'class': ['classes'],
+	'teacher': ['teacher'],
+	'subjects': ['subjects'],
+	'rooms': ['rooms'],
+	'timeframes': ['pupil', 'duty']
+}
+
+# fields which change on every run without a change of the plan.
+VOLATILE_FIELDS = ['stand']
+VOLATILE_SYSTEM_FIELDS = ['fname']
+
+# encodings of the result => content type.
+ENCODINGS = {
+	'json': 'application/json;charset=utf-8',
+	'msgpack': 'application/msgpack',
+	'cbor': 'application/cbor'
+}
+
+# lists which are encoded entry by entry when streaming.
+STREAM_KEYS = ['plan', 'added']
+
+# layout "columns": run-length / dictionary encoded fields of the rows.
+RLE_COLUMNS = ['type', 'date']
+DICT_COLUMNS = [
+	'starttime', 'endtime', 'courseRef', 'teacher', 'subject', 'room', 'course',
+	'chgteacher', 'chgsubject', 'chgroom', 'notes', 'info'
+]
+
+def encodeValue(value, default=list):
+	"""Encodes the value like jsonbackend.dumps(), but writes the bytes of
+	pre-encoded values (jsonbackend.Encoded) as they are."""
+	if isinstance(value, jsonbackend.Encoded):
+		return value.data
+	elif isinstance(value, dict) and any([isinstance(v, jsonbackend.Encoded) for v in value.values()]):
+		itemSeparator, keySeparator = jsonbackend.SEPARATORS
+		return b'{' + itemSeparator.join([
+			jsonbackend.dumps(k) + keySeparator + encodeValue(v, default) for k, v in value.items()
+		]) + b'}'
+
+	return jsonbackend.dumps(value, default=default)
+
+def dumps(table):
+	"""Encodes the result (see encodeValue). A lazy plan is expanded."""
+	return encodeValue(table)
+
+def isEncodingAvailable(encoding):
+	return encoding == 'json' or \
+		(encoding == 'msgpack' and msgpack is not None) or \
+		(encoding == 'cbor' and cbor2 is not None)
+
+def _plainValue(obj):
+	# pre-encoded JSON or a lazy plan.
+	if isinstance(obj, jsonbackend.Encoded):
+		return obj.value
+
+	return list(obj)
+
+def encode(table, encoding='json'):
+	"""Encodes the result as JSON, MessagePack or CBOR (see ENCODINGS)."""
+	if encoding == 'msgpack':
+		return msgpack.packb(table, default=_plainValue, use_bin_type=True)
+	elif encoding == 'cbor':
+		return cbor2.dumps(table, default=lambda encoder, obj: encoder.encode(_plainValue(obj)))
+
+	return dumps(table)
+
+def decode(data, encoding='json'):
+	if encoding == 'msgpack':
+		return msgpack.unpackb(data, raw=False, strict_map_key=False)
+	elif encoding == 'cbor':
+		return cbor2.loads(data)
+
+	return jsonbackend.loads(data)
+
+class JSONStream(object):
+	"""Serializes the result incrementally into UTF-8 encoded chunks.
+
+	The output is identical to dumps(table). The entries of the lists in
+	STREAM_KEYS (or any iterable, e.g. planparser.basic.PlanEntries) are
+	encoded one by one, so the complete JSON document is never
+	held in memory. Every iteration encodes the result again, so the stream
+	can be consumed several times (e.g. once per upload target).
+	"""
+
+	def __init__(self, table, chunkSize=65536):
+		self.table = table
+		self.chunkSize = chunkSize
+
+	def iterencode(self):
+		itemSeparator, keySeparator = jsonbackend.SEPARATORS
+		yield b'{'
+		for i, (k, v) in enumerate(self.table.items()):
+			if i > 0:
+				yield itemSeparator
+			yield jsonbackend.dumps(k) + keySeparator
+			if k in STREAM_KEYS and not isinstance(v, (str, dict)):
+				yield b'['
+				for j, e in enumerate(v):
+					yield itemSeparator + jsonbackend.dumps(e) if j > 0 else jsonbackend.dumps(e)
+				yield b']'
+			else:
+				yield encodeValue(v)
+		yield b'}'
+
+	def __iter__(self):
+		buf = []
+		size = 0
+		for part in self.iterencode():
+			buf.append(part)
+			size += len(part)
+			if size >= self.chunkSize:
+				yield b''.join(buf)
+				buf = []
+				size = 0
+
+		if buf:
+			yield b''.join(buf)
+
+	def writeTo(self, f):
+		for chunk in self:
+			f.write(chunk)
+
+class FileStream(object):
+	"""Reads an already serialized plan chunk by chunk (e.g. from the outbox)."""
+
+	def __init__(self, fileName, chunkSize=65536):
+		self.fileName = fileName
+		self.chunkSize = chunkSize
+
+	def __iter__(self):
+		with open(self.fileName, 'rb') as f:
+			while True:
+				chunk = f.read(self.chunkSize)
+				if not chunk:
+					break
+				yield chunk
+
+	def writeTo(self, f):
+		for chunk in self:
+			f.write(chunk)
+
+def planGuids(plan):
+	"""Returns the GUIDs of the entries (without expanding a lazy plan again)."""
+	if hasattr(plan, 'guids'):
+		return plan.guids()
+
+	return [e['guid'] for e in plan]
+
+def resultFingerprint(table):
+	"""Canonical hash of the result which ignores volatile fields (e.g. "stand").
+
+	Master data with hashes is only covered by its hashes, so it is not encoded again.
+	"""
+	h = hashlib.sha256()
+	hashes = table.get('hashes', {})
+	rest = dict([
+		(k, v) for k, v in table.items() \
+		if k not in VOLATILE_FIELDS and k != 'plan' and \
+			not (k in MASTER_DATA and all([key in hashes for key in MASTER_DATA[k]]))
+	])
+	if 'system' in rest:
+		rest['system'] = dict([(k, v) for k, v in rest['system'].items() if k not in VOLATILE_SYSTEM_FIELDS])
+	h.update(jsonbackend.canonical(rest, sortKeys=True))
+	# the GUID is a hash over all fields of the entry.
+	for guid in planGuids(table.get('plan', [])):
+		h.update(guid.encode('utf-8'))
+
+	return h.hexdigest()
+
+def guidSetHash(guids):
+	h = hashlib.sha256()
+	for guid in sorted(set(guids)):
+		h.update(guid.encode('utf-8'))
+		h.update(b'\n')
+
+	return h.hexdigest()
+
+def changedMasterData(table, hashes):
+	"""Returns the master data sections whose hashes differ from the given ones."""
+	changed = []
+	tableHashes = table.get('hashes', {})
+	for section, keys in MASTER_DATA.items():
+		if section not in table:
+			continue
+
+		for k in keys:
+			if hashes.get(k) != tableHashes.get(k):
+				changed.append(section)
+				break
+
+	return changed
+
+def stripMasterData(table, hashes):
+	"""Returns a copy of the result without the master data the server already has.
+
+	The left out sections are listed in "unchanged", their hashes are still
+	part of "hashes".
+	"""
+	changed = changedMasterData(table, hashes)
+	result = dict([(k, v) for k, v in table.items() if k not in MASTER_DATA or k in changed])
+	result['unchanged'] = [s for s in MASTER_DATA if s in table and s not in changed]
+	return result
+
+def buildDelta(table, guids, hashes):
+	"""Builds a delta (upload type "delta") against the acknowledged GUIDs and hashes.
+
+	Instead of "plan", the delta contains the entries which were "added" and
+	the GUIDs of the entries which were "removed". Master data is only
+	included if it changed. "base" and "target" are hashes of the GUID
+	set before and after applying the delta.
+	"""
+	known = set(guids)
+	current = set()
+	added = []
+	for e in table['plan']:
+		if e['guid'] in current:
+			continue
+
+		current.add(e['guid'])
+		if e['guid'] not in known:
+			added.append(e)
+
+	delta = dict([(k, v) for k, v in table.items() if k != 'plan' and k not in MASTER_DATA])
+	delta['base'] = guidSetHash(known)
+	delta['target'] = guidSetHash(current)
+	delta['added'] = added
+	delta['removed'] = sorted(known - current)
+	for section in changedMasterData(table, hashes):
+		delta[section] = table[section]
+
+	return delta
+
+def splitPlan(table, mode='count', size=2000):
+	"""Splits the entries of the plan into shards of at most "size" entries.
+
+	In mode "date" a shard only contains entries of one date.
+	"""
+	shards = []
+	current = {}
+	for e in table['plan']:
+		key = e.get('date', '') if mode == 'date' else ''
+		shard = current.get(key)
+		if shard is None or (size > 0 and len(shard) >= size):
+			shard = []
+			current[key] = shard
+			shards.append(shard)
+		shard.append(e)
+
+	return shards or [[]]
+
+def buildShard(batch, seq, shards, entries):
+	"""Builds one part (upload type "shard") of a batch."""
+	return {
+		'batch': batch,
+		'seq': seq,
+		'shards': shards,
+		'plan': entries
+	}
+
+def buildCommit(table, batch, shards):
+	"""Builds the request (upload type "commit") which completes a batch.
+
+	It contains everything except the plan itself. "target" is the hash of
+	the GUID set the server must have after putting the shards together.
+	"""
+	commit = dict([(k, v) for k, v in table.items() if k != 'plan'])
+	commit['batch'] = batch
+	commit['shards'] = shards
+	commit['target'] = guidSetHash(planGuids(table['plan']))
+	return commit
+
+def encodeColumns(rows):
+	"""Encodes the rows of the plan column by column (layout "columns").
+
+	"fields" is the order of the fields of a row, "columns" holds one entry
+	per field which is either
+	 - a list with the value of every row,
+	 - {"rle": [[value, count], ...]} (RLE_COLUMNS) or
+	 - {"dict": [value, ...], "index": [...]} (DICT_COLUMNS) where "index"
+	   is the position of the value in "dict" for every row.
+	"""
+	fields = []
+	width = 0
+	getter = None
+	padding = False
+	tuples = []
+	for row in rows:
+		if len(row) == width:
+			try:
+				tuples.append(getter(row))
+				continue
+			except KeyError:
+				pass
+
+		# first row or a row with other fields.
+		for f in row:
+			if f not in fields:
+				fields.append(f)
+				padding = padding or len(tuples) > 0
+		width = len(fields)
+		getter = itemgetter(*fields) if width > 1 else lambda r: (r[fields[0]],)
+		tuples.append(tuple([row.get(f) for f in fields]))
+
+	if padding:
+		tuples = [t + (None,) * (width - len(t)) for t in tuples]
+
+	columns = {}
+	for f, values in zip(fields, zip(*tuples)):
+		if f in RLE_COLUMNS:
+			columns[f] = {'rle': [[v, sum(1 for i in run)] for v, run in groupby(values)]}
+		elif f in DICT_COLUMNS:
+			distinct = list(dict.fromkeys(values))
+			positions = dict([(v, i) for i, v in enumerate(distinct)])
+			columns[f] = {'dict': distinct, 'index': list(map(positions.__getitem__, values))}
+		else:
+			columns[f] = list(values)
+
+	return {
+		'layout': 'columns',
+		'count': len(tuples),
+		'fields': fields,
+		'columns': columns
+	}
+
+def withColumns(table, key='plan'):
+	"""Returns a copy of the table with the rows in "key" in layout "columns"."""
+	result = dict(table)
+	result[key] = encodeColumns(table[key])
+	return result
+
+def decodeColumns(plan):
+	"""Turns a plan of layout "columns" back into the list of rows."""
+	values = []
+	for f in plan['fields']:
+		column = plan['columns'][f]
+		if isinstance(column, dict) and 'rle' in column:
+			column = [v for v, n in column['rle'] for i in range(n)]
+		elif isinstance(column, dict):
+			column = [column['dict'][i] for i in column['index']]
+		values.append(column)
+
+	return [dict(zip(plan['fields'], row)) for row in zip(*values)]
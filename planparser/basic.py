@@ -22,6 +22,9 @@ class SkippedItem(Exception):
 	pass
 
 class TimeFrame(object):
+	# parsers create a lot of these: no __dict__ per instance. Subclasses
+	# must declare __slots__ as well (empty, if they add no attributes).
+	__slots__ = ('weekday', 'hour', 'start', 'end')
 
 	def __init__(self, hour=None, start=None, end=None, weekday=0):
 		self.weekday = weekday
@@ -31,9 +34,7 @@ class TimeFrame(object):
 
 	@property
 	def sortkey(self):
-		return '{:d}-{:d}'.format(
-			self.weekday, self.hour
-		)
+		return (self.weekday, self.hour)
 
 	def __eq__(self, other):
 		return self.weekday == other.weekday and \
@@ -83,61 +84,82 @@ class TimeFrame(object):
 		return self.toDict()
 
 class Timetable(list):
+	"""Time frames as (sortkey, time frame) ordered by weekday and hour.
+
+	find() looks the time frame up in a dict. Load many time frames with
+	extend() (or the constructor) - they are sorted only once.
+	"""
 
-	def __init__(self):
+	def __init__(self, entries=None):
 		super().__init__()
 		self._keys = []
+		self._index = {}
+		if entries:
+			self.extend(entries)
 
 	def append(self, entry):
-		super().append(
-			(entry.sortkey, entry)
-		)
+		key = entry.sortkey
+		# after the ones with the same key (like a stable sort).
+		pos = bisect.bisect_right(self._keys, key)
+		self._keys.insert(pos, key)
+		super().insert(pos, (key, entry))
+		self._index.setdefault(key, entry)
+
+	def extend(self, entries):
+		super().extend([(entry.sortkey, entry) for entry in entries])
 		self.sort()
 
 	def sort(self):
 		super().sort(key=lambda r: r[0])
 		self._keys = [ r[0] for r in self ]
+		self._index = {}
+		for key, entry in self:
+			self._index.setdefault(key, entry)
 
 	def serialize(self):
 		return [ t[1].serialize() for t in self ]
 
 	@classmethod
 	def generateYardduties(cls, data):
-		self = cls()
+		frames = []
 		lastEntry = None
 		for sk, entry in data:
 			if lastEntry and \
 				lastEntry.weekday == entry.weekday and \
 				lastEntry.end != entry.start:
-				tf = TimeFrame(entry.hour, lastEntry.end, entry.start, entry.weekday)
-				self.append(tf)
+				frames.append(TimeFrame(entry.hour, lastEntry.end, entry.start, entry.weekday))
 
 			lastEntry = entry
 
-		return self
+		return cls(frames)
 
 	def find(self, weekday, hour):
-		key = '{:d}-{:d}'.format(weekday, hour)
 		try:
-			res = bisect.bisect_left(self._keys, key)
-			return self[res][1]
-		except:
-			return None
+			return self._index[(weekday, hour)]
+		except KeyError:
+			pass
+
+		# not there: the next one (as always).
+		res = bisect.bisect_left(self._keys, (weekday, hour))
+		return self[res][1] if res < len(self) else None
 
 	def findByTime(self, startTime, endTime, weekday=0):
 		timeObjects = []
 		start = startTime if len(startTime) > 4 else startTime + "00"
 		end = endTime if len(endTime) > 4 else endTime + "00"
 
-		for sk, to in self:
-			if to.weekday == weekday and \
-				to.start >= start and \
+		# only the time frames of the weekday.
+		first = bisect.bisect_left(self._keys, (weekday,))
+		last = bisect.bisect_left(self._keys, (weekday + 1,))
+		for sk, to in self[first:last]:
+			if to.start >= start and \
 				to.end <= end:
 				timeObjects.append(to)
 
 		return timeObjects
 
 class Teacher(object):
+	__slots__ = ('id', 'abbreviation', 'firstName', 'lastName')
 
 	def __init__(self, abbreviation=None, firstName=None, lastName=None, teacherId=None):
 		self.id = teacherId
@@ -159,7 +181,8 @@ class Teacher(object):
 		}
 
 class Subject(object):
-	
+	__slots__ = ('id', 'abbreviation', 'description')
+
 	def __init__(self, abbreviation=None, description='', subjectId=None):
 		self.id = subjectId
 		self.abbreviation = abbreviation
@@ -178,7 +201,8 @@ class Subject(object):
 		}
 
 class Room(object):
-	
+	__slots__ = ('id', 'abbreviation', 'description')
+
 	def __init__(self, abbreviation=None, description='', roomId=None):
 		self.id = roomId
 		self.abbreviation = abbreviation
@@ -197,7 +221,8 @@ class Room(object):
 		}
 
 class SchoolClass(object):
-	
+	__slots__ = ('id', 'abbreviation', 'description', 'team')
+
 	def __init__(self, abbreviation=None, description='', classId=None, team=None):
 		self.id = classId
 		self.abbreviation = abbreviation
@@ -308,6 +333,10 @@ class Parser(QObject):
 	def onlyFirstFile():
 		return False
 
+	@staticmethod
+	def requiredFiles():
+		return []
+
 	@staticmethod
 	def cknull(data):
 		if not data.strip():
@@ -315,6 +344,10 @@ class Parser(QObject):
 		else:
 			return data
 
+	def getGuidMode(self):
+		"""Returns how the GUIDs of the entries are generated ("compat" or "fast")."""
+		return self._config.get('options', 'guidMode', fallback='compat')
+
 	def hasErrors(self):
 		if hasattr(self, '_errorDialog'):
 			return self._errorDialog.hasData
@@ -336,6 +369,13 @@ class ChangeEntry(object):
 	CHANGE_TYPE_STANDIN = 1024
 	CHANGE_TYPE_REGULAR = 2048
 
+	__slots__ = (
+		'_planType', '_chgType', '_dates', '_hours', '_startTime', '_endTime',
+		'_teacher', '_subject', '_room', '_course', '_changeTeacher',
+		'_changeSubject', '_changeRoom', '_courseRef', '_note', '_info',
+		'_reasonRef'
+	)
+
 	def __init__(self, dates, planType, chgType = 0):
 		self._planType = planType
 		self._chgType = chgType
@@ -353,6 +393,7 @@ class ChangeEntry(object):
 		self._courseRef = None
 		self._note = ''
 		self._info = ''
+		self._reasonRef = None
 
 	def hasChanges(self):
 		if self._changeTeacher \
@@ -461,34 +502,141 @@ class ChangeEntry(object):
 	def __gt__(self, other):
 		return not self < other and not self == other
 
-	def asDict(self):
+	def countRows(self):
+		"""Returns the number of rows asDict() returns."""
+		return len(self._dates) * max(1, len(self._course)) * len(self._hours)
+
+	@staticmethod
+	def _jsonField(key, value):
+		# same as the field would look like in json.dumps() of the row.
+		return (', "' + key + '": ' + json.dumps(value)).encode('utf-8')
+
+	@staticmethod
+	def _binaryField(key, value):
+		if value is None:
+			return b'\x00'
+		elif isinstance(value, int):
+			return b'\x01%d;' % (value,)
+
+		value = str(value).encode('utf-8')
+		return b'\x02%d:%s' % (len(value), value)
+
+	def asDict(self, guidMode='compat'):
+		"""Expands the entry into one row per day, course and hour.
+
+		The GUID of a row is a hash over all its fields. In mode "compat" the
+		hash input is json.dumps() of the row (GUIDs as always), in mode "fast"
+		a shorter binary encoding. Either way, the fields are encoded once per
+		entry and the hash state of the common prefix is reused for every row.
+		"""
 		entries = []
 		if len(self._course) == 0:
 			self._course.append(None)
 
+		if guidMode == 'fast':
+			field = ChangeEntry._binaryField
+			head = hashlib.blake2s(b'vplan-guid/2' + field('type', self._planType), digest_size=16)
+			tail = b''
+		else:
+			field = ChangeEntry._jsonField
+			head = hashlib.blake2s(b'{' + field('type', self._planType)[2:], digest_size=16)
+			tail = b'}'
+
+		teacher = str(self._teacher) if self._teacher is not None else None
+		changeTeacher = str(self._changeTeacher) if self._changeTeacher is not None else None
+		hours = []
+		for tf in self._hours:
+			start = self._startTime if tf.start is None else tf.start
+			end = self._endTime if tf.end is None else tf.end
+			hours.append((tf.hour, start, end, b''.join([
+				field('hour', tf.hour),
+				field('starttime', start),
+				field('endtime', end),
+				field('courseRef', self._courseRef),
+				field('teacher', teacher),
+				field('subject', self._subject),
+				field('room', self._room),
+				field('chgType', self._chgType)
+			])))
+
+		courses = []
+		for cour in self._course:
+			cour = str(cour) if cour is not None else None
+			courses.append((cour, b''.join([
+				field('course', cour),
+				field('chgteacher', changeTeacher),
+				field('chgsubject', self._changeSubject),
+				field('chgroom', self._changeRoom),
+				field('notes', self._note),
+				field('info', self._info),
+				tail
+			])))
+
+		rows = [
+			(cour, hour, start, end, hourPart + coursePart) \
+			for cour, coursePart in courses for hour, start, end, hourPart in hours
+		]
 		for day in self._dates:
-			for cour in self._course:
-				for tf in self._hours:
-					e = {
-						'type': self._planType,
-						'date': day,
-						'hour': tf.hour,
-						'starttime': self._startTime if tf.start is None else tf.start,
-						'endtime': self._endTime if tf.end is None else tf.end,
-						'courseRef': self._courseRef,
-						'teacher': str(self._teacher) if self._teacher is not None else None,
-						'subject': self._subject,
-						'room': self._room,
-						'chgType': self._chgType,
-						'course': str(cour) if cour is not None else None,
-						'chgteacher': str(self._changeTeacher) if self._changeTeacher is not None else None,
-						'chgsubject': self._changeSubject,
-						'chgroom': self._changeRoom,
-						'notes': self._note,
-						'info': self._info
-					}
-					# generate guid
-					e['guid'] = str(uuid.UUID(hashlib.blake2s(json.dumps(e).encode('utf-8'), digest_size=16).hexdigest()))
-					entries.append(e)
+			dayHash = head.copy()
+			dayHash.update(field('date', day))
+			for cour, hour, start, end, rowPart in rows:
+				guid = dayHash.copy()
+				guid.update(rowPart)
+				guid = guid.hexdigest()
+				entries.append({
+					'type': self._planType,
+					'date': day,
+					'hour': hour,
+					'starttime': start,
+					'endtime': end,
+					'courseRef': self._courseRef,
+					'teacher': teacher,
+					'subject': self._subject,
+					'room': self._room,
+					'chgType': self._chgType,
+					'course': cour,
+					'chgteacher': changeTeacher,
+					'chgsubject': self._changeSubject,
+					'chgroom': self._changeRoom,
+					'notes': self._note,
+					'info': self._info,
+					'guid': '{:s}-{:s}-{:s}-{:s}-{:s}'.format(
+						guid[:8], guid[8:12], guid[12:16], guid[16:20], guid[20:]
+					)
+				})
 
 		return entries
+
+class PlanEntries(object):
+	"""The "plan" of a result: the rows of the change entries, created while iterating.
+
+	The entries are expanded (see ChangeEntry.asDict) on every iteration, so
+	all rows are never held in memory at once. The lists of change entries
+	are not concatenated. The GUIDs are kept after the first complete
+	iteration.
+	"""
+
+	def __init__(self, entryLists, guidMode='compat'):
+		self._entryLists = entryLists
+		self._guidMode = guidMode
+		self._guids = None
+
+	def __iter__(self):
+		guids = []
+		for entries in self._entryLists:
+			for ce in entries:
+				for e in ce.asDict(self._guidMode):
+					guids.append(e['guid'])
+					yield e
+
+		self._guids = guids
+
+	def __len__(self):
+		return sum([ce.countRows() for entries in self._entryLists for ce in entries])
+
+	def guids(self):
+		if self._guids is None:
+			for e in self:
+				pass
+
+		return self._guids
@@ -6,17 +6,17 @@
 #
 # @author Lukas Schreiner
 import time
-import json
 import pprint
 import re
-import hashlib
 import datetime
 from codecs import BOM_UTF8
 from planparser import basic
-from planparser.basic import ChangeEntry
+from planparser import jsonbackend
+from planparser.basic import ChangeEntry, PlanEntries
 from planparser.basic import DuplicateItem, SuperseedingItem, SkippedItem
 
 class TimeFrame(basic.TimeFrame):
+	__slots__ = ()
 
 	@classmethod
 	def fromJson(cls, data):
@@ -105,7 +105,7 @@ class Parser(basic.Parser):
 			self._encoding = 'utf-8-sig'
 
 		try:
-			self._fileContent = json.loads(self._fileContent.decode(self._encoding))
+			self._fileContent = jsonbackend.loads(self._fileContent.decode(self._encoding))
 		except ValueError:
 			raise
 
@@ -177,13 +177,10 @@ class Parser(basic.Parser):
 
 		# time frames
 		for tf in self._fileContent['result']['timeframes']:
-			if tf['code'] in ['Standard', 'Aufsichten']:
-				for t in tf['timeslots']:
-					te = TimeFrame.fromJson(t)
-					if tf['code'] == 'Standard':
-						self._timeFramesPupil.append(te)
-					elif tf['code'] == 'Aufsichten':
-						self._timeFramesDuty.append(te)
+			if tf['code'] == 'Standard':
+				self._timeFramesPupil.extend([TimeFrame.fromJson(t) for t in tf['timeslots']])
+			elif tf['code'] == 'Aufsichten':
+				self._timeFramesDuty.extend([TimeFrame.fromJson(t) for t in tf['timeslots']])
 
 		# class absent reason
 		if 'classAbsenceReasons' in self._fileContent['result'].keys():
@@ -489,7 +486,7 @@ class Parser(basic.Parser):
 				'roomCodes': les['roomCodes'] if 'roomCodes' in les.keys() else [],
 				'teacherCodes': les['teacherCodes'] if 'teacherCodes' in les.keys() else []
 			}
-			mainhash = hashlib.sha256(json.dumps(mainkey, sort_keys=True).encode('utf-8')).hexdigest()
+			mainhash = jsonbackend.sha256(mainkey, sortKeys=True)
 			skip = False
 			for subles in self._fileContent['result']['displaySchedule']['lessonTimes']:
 				# skip which don't have changes
@@ -512,7 +509,7 @@ class Parser(basic.Parser):
 					'roomCodes': subles['roomCodes'],
 					'teacherCodes': subles['teacherCodes']
 				}
-				subhash = hashlib.sha256(json.dumps(subkey, sort_keys=True).encode('utf-8')).hexdigest()
+				subhash = jsonbackend.sha256(subkey, sortKeys=True)
 				if subhash != mainhash:
 					continue
 				elif subles['changes']['changeType'] == 0:
@@ -671,7 +668,7 @@ class Parser(basic.Parser):
 		for les in self._fileContent['result']['displaySchedule']['lessonTimes']:
 			try:
 				# create a hash
-				lesHash = hashlib.sha256(json.dumps(les, sort_keys=True).encode('utf-8')).hexdigest()
+				lesHash = jsonbackend.sha256(les, sortKeys=True)
 				if lesHash in duplicateLes:
 					self._errorDialog.addData(pprint.pformat(les))
 					self._errorDialog.addInfo('Found duplicate entry (hash: {:s}).'.format(lesHash))
@@ -774,15 +771,17 @@ class Parser(basic.Parser):
 				self._supervision.append(newEntry)
 
 	def getResult(self, transaction=None):
-		planEntries = []
-		planObjects = self._absentClasses + self._absentTeacher + self._supervision + self._standin
-		for f in planObjects:
-			planEntries.extend(f.asDict())
-
-		encClasses = self._classList.serialize()
-		encTeachers = self._teacherList.serialize()
-		encSubjects = self._subjectList.serialize()
-		encRooms = self._roomList.serialize()
+		planEntries = PlanEntries(
+			[self._absentClasses, self._absentTeacher, self._supervision, self._standin],
+			self.getGuidMode()
+		)
+
+		encClasses = jsonbackend.Encoded(self._classList.serialize())
+		encTeachers = jsonbackend.Encoded(self._teacherList.serialize())
+		encSubjects = jsonbackend.Encoded(self._subjectList.serialize())
+		encRooms = jsonbackend.Encoded(self._roomList.serialize())
+		encTimeframes = jsonbackend.Encoded(self._timeFramesPupil.serialize())
+		encTimeframesDuty = jsonbackend.Encoded(self._timeFramesDuty.serialize())
 		return {
 			'stand': self._stand,
 			'plan': planEntries,
@@ -792,15 +791,15 @@ class Parser(basic.Parser):
 			'subjects': encSubjects,
 			'rooms': encRooms,
 			'timeframes': {
-				'pupil': self._timeFramesPupil.serialize(),
-				'duty': self._timeFramesDuty.serialize()
+				'pupil': encTimeframes,
+				'duty': encTimeframesDuty
 			},
 			'hashes': {
-				'pupil': hashlib.sha256(json.dumps(self._timeFramesPupil.serialize()).encode('utf-8')).hexdigest(),
-				'duty': hashlib.sha256(json.dumps(self._timeFramesDuty.serialize()).encode('utf-8')).hexdigest(),
-				'classes': hashlib.sha256(json.dumps(encClasses).encode('utf-8')).hexdigest(),
-				'teacher': hashlib.sha256(json.dumps(encTeachers).encode('utf-8')).hexdigest(),
-				'subjects': hashlib.sha256(json.dumps(encSubjects).encode('utf-8')).hexdigest(),
-				'rooms': hashlib.sha256(json.dumps(encRooms).encode('utf-8')).hexdigest()
+				'pupil': encTimeframes.sha256(),
+				'duty': encTimeframesDuty.sha256(),
+				'classes': encClasses.sha256(),
+				'teacher': encTeachers.sha256(),
+				'subjects': encSubjects.sha256(),
+				'rooms': encRooms.sha256()
 			}
 		}
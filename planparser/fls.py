@@ -5,12 +5,11 @@
 # parser.
 #
 # @author Lukas Schreiner
-import hashlib
-import json
 import time
 import csv
 from planparser import basic
-from planparser.basic import ChangeEntry
+from planparser import jsonbackend
+from planparser.basic import ChangeEntry, PlanEntries
 
 class Parser(basic.Parser):
 
@@ -98,17 +97,15 @@ class Parser(basic.Parser):
 			self.planParsed.emit(planParsedSuccessful)
 
 	def getResult(self, transaction=None):
-		planEntries = []
-		for f in self._plan:
-			planEntries.extend(f.asDict())
+		planEntries = PlanEntries([self._plan], self.getGuidMode())
 
-		encClasses = self._classList.serialize()
+		encClasses = jsonbackend.Encoded(self._classList.serialize())
 		return {
 			'stand': self._stand,
 			'plan': planEntries,
 			'ptype': self._planType,
 			'class': encClasses,
 			'hashes': {
-				'classes': hashlib.sha256(json.dumps(encClasses).encode('utf-8')).hexdigest()
+				'classes': encClasses.sha256()
 			}
 		}
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+#
+# Encodes and decodes JSON with orjson if it is installed, otherwise with
+# the json module of the standard library.
+#
+# The output of dumps() depends on the library. Everything which is hashed
+# (GUIDs, hashes of the master data, fingerprints) must use canonical()
+# resp. sha256() which always produce the output of json.dumps().
+#
+# @author Lukas Schreiner
+import hashlib
+import json
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# separators of dumps(): between items and between key and value.
+SEPARATORS = (b',', b':') if orjson is not None else (b', ', b': ')
+
+class Encoded(object):
+	"""A value together with its canonical encoding.
+
+	The parsers return the master data like this, so it is encoded only once:
+	the hash is taken from the bytes and payload.dumps()/JSONStream write the
+	same bytes into the upload. Everywhere else it is treated as the value.
+	"""
+
+	def __init__(self, value):
+		self.value = value
+		self.data = canonical(value)
+
+	def sha256(self):
+		return hashlib.sha256(self.data).hexdigest()
+
+def _unwrap(default):
+	def unwrap(obj):
+		if isinstance(obj, Encoded):
+			return obj.value
+		elif default is not None:
+			return default(obj)
+
+		raise TypeError('Object of type {:s} is not JSON serializable'.format(type(obj).__name__))
+
+	return unwrap
+
+def loads(data):
+	"""Decodes the JSON document (str or UTF-8 encoded bytes)."""
+	if orjson is not None:
+		try:
+			return orjson.loads(data)
+		except ValueError:
+			# e.g. NaN or very large numbers - the standard library is less strict.
+			pass
+
+	if isinstance(data, bytes):
+		data = data.decode('utf-8')
+
+	return json.loads(data)
+
+def dumps(obj, default=None):
+	"""Encodes the object as UTF-8 encoded JSON as fast as possible.
+
+	Never hash the result - use canonical() instead.
+	"""
+	if orjson is not None:
+		try:
+			return orjson.dumps(obj, default=_unwrap(default), option=orjson.OPT_NON_STR_KEYS)
+		except TypeError:
+			# e.g. integers with more than 64 bit.
+			pass
+
+	return json.dumps(obj, default=_unwrap(default)).encode('utf-8')
+
+def canonical(obj, sortKeys=False):
+	"""Encodes the object exactly like json.dumps() (UTF-8 encoded)."""
+	return json.dumps(obj, sort_keys=sortKeys, default=_unwrap(None)).encode('utf-8')
+
+def sha256(obj, sortKeys=False):
+	"""Returns the hex encoded SHA-256 of the canonical encoding of the object."""
+	return hashlib.sha256(canonical(obj, sortKeys)).hexdigest()
@@ -6,42 +6,46 @@
 #
 # @author Lukas Schreiner
 import time
-import json
 import re
-import hashlib
 import datetime
 import os.path
 import datetime
 import csv
 import bisect
 from planparser import basic
-from planparser.basic import ChangeEntry
+from planparser import jsonbackend
+from planparser.basic import ChangeEntry, PlanEntries
 
 class SchoolClass(basic.SchoolClass):
-	
+	__slots__ = ()
+
 	@classmethod
 	def fromList(cls, data):
 		return cls(data[0], data[1])
 
 class Room(basic.Room):
-	
+	__slots__ = ()
+
 	@classmethod
 	def fromList(cls, data):
 		return cls(data[0], data[1])
 
 class Subject(basic.Subject):
-	
+	__slots__ = ()
+
 	@classmethod
 	def fromList(cls, data):
 		return cls(data[0], data[1])
 
 class Teacher(basic.Teacher):
-	
+	__slots__ = ()
+
 	@classmethod
 	def fromList(cls, data):
 		return cls(data[0], data[1], data[3])
 
 class PlanDate(object):
+	__slots__ = ('week', 'day', 'date', 'schoolWeek')
 
 	def __init__(self, week, day, date, schoolWeek):
 		self.week = week
@@ -61,6 +65,10 @@ class PlanDate(object):
 		return self
 
 class Lesson(object):
+	__slots__ = (
+		'teacher', 'weekday', 'hour', 'subject', 'room', 'untisNumber',
+		'className', 'weekFlags', 'flag', 'lineNumber'
+	)
 
 	def __init__(self):
 		self.teacher = None
@@ -244,6 +252,11 @@ class LessonList(list):
 			return None
 
 class Substitution(object):
+	__slots__ = (
+		'nr', 'type', 'date', 'day', 'hour', 'time', 'subject', 'changeSubject',
+		'teacher', 'changeTeacher', 'className', 'changeClassName', 'room',
+		'changeRoom', 'movedInfo', 'notes'
+	)
 
 	def __init__(self):
 		self.nr = None
@@ -304,6 +317,7 @@ class Substitution(object):
 		return self
 
 class Supervision(object):
+	__slots__ = ('weekday', 'date', 'hour', 'corridor', 'teacher', 'standinTeacher', 'flag')
 
 	def __init__(self):
 		self.weekday = None
@@ -353,6 +367,7 @@ class Supervision(object):
 		return self
 
 class TimeFrame(basic.TimeFrame):
+	__slots__ = ()
 
 	@classmethod
 	def fromList(cls, data):
@@ -369,6 +384,20 @@ class Parser(basic.Parser):
 
 	EXTENSIONS = ['.txt']
 
+	FILES = {
+		'date.txt': 'parseDates',
+		'time.txt': 'parseTimes',
+		'class.txt': 'parseClasses',
+		'room.txt': 'parseRooms',
+		'subject.txt': 'parseSubjects',
+		'teacher.txt': 'parseTeachers',
+		#'corridor.txt': 'parseCorridor',
+		'lesson.txt': 'parseLessons',
+		'substitution.txt': 'parseStandin',
+		#'student.txt': 'parseStudents',
+		'supervision.txt': 'parseSupervisions',
+	}
+
 	def __init__(self, config, errorDialog, parsingFile):
 		super().__init__(config, errorDialog, parsingFile)
 		self._planDates = []
@@ -386,20 +415,7 @@ class Parser(basic.Parser):
 		Parser.timeFramesDuty = None
 
 		self._path = os.path.dirname(self._parsingFile)
-		self._files = {
-			'date.txt': 'parseDates',
-			'time.txt': 'parseTimes',
-			'class.txt': 'parseClasses',
-			'room.txt': 'parseRooms',
-			'subject.txt': 'parseSubjects',
-			'teacher.txt': 'parseTeachers',
-			#'corridor.txt': 'parseCorridor',
-			'lesson.txt': 'parseLessons',
-			'substitution.txt': 'parseStandin',
-			#'student.txt': 'parseStudents',
-			'supervision.txt': 'parseSupervisions',
-		}
-		self._timeout = 10.0
+		self._files = Parser.FILES
 
 		# With the json interface of DaVinci 6, we support mostly all features.
 		# So here we set the default flags.
@@ -413,27 +429,14 @@ class Parser(basic.Parser):
 			self._encoding = 'utf-8'
 
 		self._stand = int(time.time())
-		# wait for all files
 		self.planParserPrepared.emit()
 
 	def parse(self, transaction=None):
 		planParsedSuccessful = True
-		# check and verify, all files are available.
-		dtstr = datetime.datetime.now()
-
-		found = False
-		while (datetime.datetime.now() - dtstr).total_seconds() <= self._timeout:
-			found = True
-			for fileName in self._files.keys():
-				if not os.path.exists(os.path.join(self._path, fileName)):
-					found = False
-					break
-
-			if not found:
-				time.sleep(1)
-
-		if not found:
-			raise Exception('Did not got all files required to parse plan within timeout.')
+		# the watcher holds the plan back until all files are written completely.
+		for fileName in self._files.keys():
+			if not os.path.exists(os.path.join(self._path, fileName)):
+				raise Exception('Did not got all files required to parse plan (missing: {:s}).'.format(fileName))
 
 		try:
 			for n, f in self._files.items():
@@ -457,9 +460,7 @@ class Parser(basic.Parser):
 	def parseTimes(self, fileName):
 		with open(fileName, newline='', encoding=self._encoding) as csvfile:
 			reader = csv.reader(csvfile, delimiter='\t', quoting=csv.QUOTE_NONE)
-			for row in reader:
-				pd = TimeFrame.fromList(row)
-				Parser.timeFrames.append(pd)
+			Parser.timeFrames.extend([TimeFrame.fromList(row) for row in reader])
 
 		# generate yard duties times.
 		Parser.timeFramesDuty = Parser.timeFrames.generateYardduties(Parser.timeFrames)
@@ -660,17 +661,17 @@ class Parser(basic.Parser):
 						break
 
 	def getResult(self, transaction=None):
-		planEntries = []
-		planObjects = self._absentClasses + self._absentTeacher + self._supervision + self._standin
-		for f in planObjects:
-			planEntries.extend(f.asDict())
-
-		encClasses = self._classList.serialize()
-		encTeachers = self._teacherList.serialize()
-		encSubjects = self._subjectList.serialize()
-		encRooms = self._roomList.serialize()
-		encTimeframes = Parser.timeFrames.serialize()
-		encTimeframesDuty = Parser.timeFramesDuty.serialize()
+		planEntries = PlanEntries(
+			[self._absentClasses, self._absentTeacher, self._supervision, self._standin],
+			self.getGuidMode()
+		)
+
+		encClasses = jsonbackend.Encoded(self._classList.serialize())
+		encTeachers = jsonbackend.Encoded(self._teacherList.serialize())
+		encSubjects = jsonbackend.Encoded(self._subjectList.serialize())
+		encRooms = jsonbackend.Encoded(self._roomList.serialize())
+		encTimeframes = jsonbackend.Encoded(Parser.timeFrames.serialize())
+		encTimeframesDuty = jsonbackend.Encoded(Parser.timeFramesDuty.serialize())
 		return {
 			'stand': self._stand,
 			'plan': planEntries,
@@ -684,15 +685,19 @@ class Parser(basic.Parser):
 				'duty': encTimeframesDuty
 			},
 			'hashes': {
-				'pupil': hashlib.sha256(json.dumps(encTimeframes).encode('utf-8')).hexdigest(),
-				'duty': hashlib.sha256(json.dumps(encTimeframesDuty).encode('utf-8')).hexdigest(),
-				'classes': hashlib.sha256(json.dumps(encClasses).encode('utf-8')).hexdigest(),
-				'teacher': hashlib.sha256(json.dumps(encTeachers).encode('utf-8')).hexdigest(),
-				'subjects': hashlib.sha256(json.dumps(encSubjects).encode('utf-8')).hexdigest(),
-				'rooms': hashlib.sha256(json.dumps(encRooms).encode('utf-8')).hexdigest()
+				'pupil': encTimeframes.sha256(),
+				'duty': encTimeframesDuty.sha256(),
+				'classes': encClasses.sha256(),
+				'teacher': encTeachers.sha256(),
+				'subjects': encSubjects.sha256(),
+				'rooms': encRooms.sha256()
 			}
 		}
 
 	@staticmethod
 	def onlyFirstFile():
 		return True
+
+	@staticmethod
+	def requiredFiles():
+		return list(Parser.FILES.keys())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+#
+# Runs a parser outside of the GUI process (e.g. in a process pool).
+#
+# @author Lukas Schreiner
+import configparser
+import importlib
+
+class ErrorLog(object):
+	"""Collects the messages of a parser in order to replay them on the error dialog."""
+
+	def __init__(self):
+		self.hasData = False
+		self.entries = []
+
+	def _add(self, method, *args):
+		self.hasData = True
+		self.entries.append((method, args))
+
+	def addDebug(self, msg, data=None):
+		self._add('addDebug', msg, data)
+
+	def addInfo(self, msg):
+		self._add('addInfo', msg)
+
+	def addWarning(self, msg):
+		self._add('addWarning', msg)
+
+	def addError(self, msg):
+		self._add('addError', msg)
+
+	def addData(self, msg):
+		self._add('addData', msg)
+
+	@staticmethod
+	def replay(entries, dialog):
+		for method, args in entries:
+			getattr(dialog, method)(*args)
+
+class NullSpan(object):
+	"""Stands in for the sentry transaction which is not available in a worker."""
+
+	def start_child(self, **kwargs):
+		return self
+
+	def set_data(self, key, value):
+		pass
+
+	def set_tag(self, key, value):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		return False
+
+def configToDict(config):
+	return dict([(s, dict(config.items(s, raw=True))) for s in config.sections()])
+
+def parseFile(moduleName, configDict, parsingFile):
+	"""Parses the file with the parser of the given module.
+
+	Returns the result of the parser (with the plan as list of rows) and
+	the collected messages.
+	"""
+	config = configparser.ConfigParser()
+	config.read_dict(configDict)
+	module = importlib.import_module(moduleName)
+	errorLog = ErrorLog()
+	span = NullSpan()
+
+	djp = module.Parser(config, errorLog, parsingFile)
+	djp.loadFile(span)
+	djp.preParse(span)
+	djp.parse(span)
+	djp.postParse(span)
+	result = djp.getResult()
+	# the rows (and GUIDs) are created here - not in the GUI process.
+	result['plan'] = list(result['plan'])
+	return result, errorLog.entries
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file resultarchive.py
+
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+class ArchiveEntry(object):
+	"""A saved result as listed in the index of the archive."""
+
+	def __init__(self, entryId, created, planType, handler, encoding, fingerprint, blob, status):
+		self.id = entryId
+		self.created = created
+		self.planType = planType
+		self.handler = handler
+		self.encoding = encoding
+		self.fingerprint = fingerprint
+		self.blob = blob
+		self.status = status
+
+	def toDict(self):
+		return {
+			'id': self.id,
+			'created': self.created,
+			'planType': self.planType,
+			'handler': self.handler,
+			'encoding': self.encoding,
+			'fingerprint': self.fingerprint,
+			'blob': self.blob,
+			'status': self.status
+		}
+
+class _BlobWriter(object):
+	"""Compresses and hashes what is written (e.g. by JSONStream.writeTo)."""
+
+	def __init__(self, f, compressLevel):
+		self.hash = hashlib.sha256()
+		self.size = 0
+		self._gzip = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compressLevel, mtime=0)
+
+	def write(self, data):
+		self.hash.update(data)
+		self.size += len(data)
+		self._gzip.write(data)
+
+	def close(self):
+		self._gzip.close()
+
+class ResultArchive(object):
+	"""Archive of the results which were sent (option "saveResult").
+
+	The results are stored gzip compressed below data/, named by the SHA-256
+	of their fingerprint and encoding: a plan which did not change is stored
+	only once, even if "stand" or the file name differ (the data of the first
+	of these results is kept). Results without fingerprint are named by the
+	SHA-256 of their content. The index (index.sqlite) has one row per saved
+	result with time, plan type, handler, fingerprint and upload status.
+
+	Old results are removed when there are more than maxCount, when they are
+	older than maxAge seconds or when the stored data exceeds maxSize bytes
+	(0 = no limit). The newest result is always kept.
+	"""
+
+	STATUS_PENDING = 'pending'
+	STATUS_UPLOADED = 'uploaded'
+	STATUS_PARTIAL = 'partial'
+	STATUS_FAILED = 'failed'
+	STATUS_SKIPPED = 'skipped'
+	STATUS_LOCAL = 'local'
+
+	COLUMNS = 'id, created, planType, handler, encoding, fingerprint, blob, status'
+
+	def __init__(self, path, maxCount=0, maxAge=0, maxSize=0, compressLevel=6):
+		self.path = path
+		self.maxCount = maxCount
+		self.maxAge = maxAge
+		self.maxSize = maxSize
+		self.compressLevel = compressLevel
+		self._lock = threading.Lock()
+		self._ready = False
+
+	def _indexFile(self):
+		return os.path.join(self.path, 'index.sqlite')
+
+	def _blobFile(self, blob):
+		# two levels - keeps the directories small.
+		return os.path.join(self.path, 'data', blob[:2], '{:s}.gz'.format(blob))
+
+	def _connect(self):
+		if not self._ready and not os.path.exists(self.path):
+			os.makedirs(self.path)
+
+		conn = sqlite3.connect(self._indexFile())
+		if not self._ready:
+			with conn:
+				conn.execute(
+					'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+					'created REAL NOT NULL, planType TEXT, handler TEXT, encoding TEXT, '
+					'fingerprint TEXT, blob TEXT NOT NULL, status TEXT)'
+				)
+				conn.execute('CREATE INDEX IF NOT EXISTS resultsCreated ON results (created)')
+				conn.execute('CREATE INDEX IF NOT EXISTS resultsBlob ON results (blob)')
+				conn.execute('CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, size INTEGER NOT NULL)')
+			self._ready = True
+
+		return conn
+
+	def _entries(self, conn, where='', args=(), order='DESC', limit=None):
+		query = 'SELECT {:s} FROM results {:s} ORDER BY created {:s}, id {:s}'.format(
+			ResultArchive.COLUMNS, where, order, order
+		)
+		if limit is not None:
+			query += ' LIMIT {:d}'.format(limit)
+
+		return [ArchiveEntry(*row) for row in conn.execute(query, args)]
+
+	def _writeBlob(self, data, blob=None):
+		"""Writes the data compressed and returns the name of the blob.
+
+		Without a name, the blob is named by the SHA-256 of the data.
+		"""
+		blobDir = os.path.join(self.path, 'data')
+		if not os.path.exists(blobDir):
+			os.makedirs(blobDir)
+
+		fd, tmpName = tempfile.mkstemp(suffix='.tmp', dir=blobDir)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				writer = _BlobWriter(f, self.compressLevel)
+				if isinstance(data, bytes):
+					writer.write(data)
+				else:
+					data.writeTo(writer)
+				writer.close()
+
+			blob = writer.hash.hexdigest() if blob is None else blob
+			blobFile = self._blobFile(blob)
+			if os.path.exists(blobFile):
+				os.remove(tmpName)
+			else:
+				if not os.path.exists(os.path.dirname(blobFile)):
+					os.makedirs(os.path.dirname(blobFile))
+				os.replace(tmpName, blobFile)
+		except BaseException:
+			if os.path.exists(tmpName):
+				os.remove(tmpName)
+			raise
+
+		return blob
+
+	def put(self, data, planType, encoding='json', handler=None, fingerprint=None, created=None):
+		"""Saves the result (bytes or a stream) and returns its entry.
+
+		Results with the same fingerprint (see payload.resultFingerprint) and
+		encoding share their data: it is only written for the first one.
+		"""
+		created = time.time() if created is None else created
+		with self._lock:
+			conn = self._connect()
+			try:
+				blob = None
+				if fingerprint is not None:
+					blob = hashlib.sha256('{:s}:{:s}'.format(encoding, fingerprint).encode('utf-8')).hexdigest()
+				if blob is None or not os.path.exists(self._blobFile(blob)):
+					blob = self._writeBlob(data, blob)
+				blobFile = self._blobFile(blob)
+
+				with conn:
+					conn.execute(
+						'INSERT OR REPLACE INTO blobs (blob, size) VALUES (?, ?)',
+						(blob, os.path.getsize(blobFile))
+					)
+					cursor = conn.execute(
+						'INSERT INTO results (created, planType, handler, encoding, fingerprint, blob, status) '
+						'VALUES (?, ?, ?, ?, ?, ?, ?)',
+						(created, planType, handler, encoding, fingerprint, blob, ResultArchive.STATUS_PENDING)
+					)
+				entry = ArchiveEntry(
+					cursor.lastrowid, created, planType, handler, encoding, fingerprint,
+					blob, ResultArchive.STATUS_PENDING
+				)
+				self._prune(conn, created)
+			finally:
+				conn.close()
+
+		return entry
+
+	def setStatus(self, entry, status):
+		with self._lock:
+			conn = self._connect()
+			try:
+				with conn:
+					conn.execute('UPDATE results SET status = ? WHERE id = ?', (status, entry.id))
+			finally:
+				conn.close()
+		entry.status = status
+
+	def entries(self, since=None, until=None, limit=None):
+		"""Returns the saved results (newest first), optionally within the time range."""
+		conditions = []
+		args = []
+		if since is not None:
+			conditions.append('created >= ?')
+			args.append(since)
+		if until is not None:
+			conditions.append('created <= ?')
+			args.append(until)
+		where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+		with self._lock:
+			conn = self._connect()
+			try:
+				return self._entries(conn, where, args, limit=limit)
+			finally:
+				conn.close()
+
+	def get(self, entryId):
+		with self._lock:
+			conn = self._connect()
+			try:
+				entries = self._entries(conn, 'WHERE id = ?', (entryId,))
+			finally:
+				conn.close()
+
+		return entries[0] if entries else None
+
+	def find(self, when):
+		"""Returns the result which was current at that time (the last one saved before)."""
+		entries = self.entries(until=when, limit=1)
+		return entries[0] if entries else None
+
+	def load(self, entry):
+		with gzip.open(self._blobFile(entry.blob), 'rb') as f:
+			return f.read()
+
+	def getSize(self):
+		"""Returns the size of the stored (compressed) data."""
+		with self._lock:
+			conn = self._connect()
+			try:
+				return conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+			finally:
+				conn.close()
+
+	def prune(self, now=None):
+		with self._lock:
+			conn = self._connect()
+			try:
+				return self._prune(conn, time.time() if now is None else now)
+			finally:
+				conn.close()
+
+	def _prune(self, conn, now):
+		"""Removes the results exceeding the limits. Returns how many were removed."""
+		newest = conn.execute('SELECT MAX(id) FROM results').fetchone()[0]
+		if newest is None:
+			return 0
+
+		remove = set()
+		if self.maxAge > 0:
+			remove.update(row[0] for row in conn.execute(
+				'SELECT id FROM results WHERE created < ? AND id != ?', (now - self.maxAge, newest)
+			))
+		if self.maxCount > 0:
+			remove.update(row[0] for row in conn.execute(
+				'SELECT id FROM results ORDER BY created DESC, id DESC LIMIT -1 OFFSET ?', (self.maxCount,)
+			))
+		if self.maxSize > 0:
+			# blobs are shared - a blob is freed with the last result using it.
+			total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+			users = {}
+			for blob, count in conn.execute('SELECT blob, COUNT(*) FROM results GROUP BY blob'):
+				users[blob] = count
+			sizes = dict(conn.execute('SELECT blob, size FROM blobs'))
+			for entryId, blob in conn.execute('SELECT id, blob FROM results ORDER BY created, id'):
+				if entryId in remove:
+					users[blob] -= 1
+					if users[blob] == 0:
+						total -= sizes.get(blob, 0)
+			for entryId, blob in conn.execute('SELECT id, blob FROM results ORDER BY created, id'):
+				if total <= self.maxSize or entryId == newest:
+					break
+				if entryId in remove:
+					continue
+				remove.add(entryId)
+				users[blob] -= 1
+				if users[blob] == 0:
+					total -= sizes.get(blob, 0)
+
+		if not remove:
+			return 0
+
+		with conn:
+			conn.executemany('DELETE FROM results WHERE id = ?', [(entryId,) for entryId in remove])
+			unused = [row[0] for row in conn.execute(
+				'SELECT blob FROM blobs WHERE blob NOT IN (SELECT blob FROM results)'
+			)]
+			conn.executemany('DELETE FROM blobs WHERE blob = ?', [(blob,) for blob in unused])
+
+		for blob in unused:
+			try:
+				os.remove(self._blobFile(blob))
+			except FileNotFoundError:
+				pass
+
+		return len(remove)
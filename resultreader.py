@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Converts a saved result (option "saveResult") into readable JSON, also
+# if it was saved as MessagePack or CBOR (option "resultEncoding").
+#
+# Usage:
+#   python resultreader.py --list [--archive results]
+#   python resultreader.py --at "2026-10-18 07:42" [--archive results] [<json file>]
+#   python resultreader.py --id 42 [--archive results] [<json file>]
+#   python resultreader.py <vplan-result file of older versions> [<json file>]
+#
+# @author Lukas Schreiner
+# @file resultreader.py
+
+import sys
+import json
+import argparse
+from datetime import datetime
+import payload
+from resultarchive import ResultArchive
+
+HEADERS = [b'Type', b'Encoding']
+
+def decodeResult(content, encoding='json'):
+	table = payload.decode(content, encoding)
+	plan = table.get('plan')
+	if isinstance(plan, dict) and plan.get('layout') == 'columns':
+		table['plan'] = payload.decodeColumns(plan)
+
+	return table
+
+def readResult(fileName):
+	"""Returns the plan type and the result saved in the file (older versions)."""
+	with open(fileName, 'rb') as f:
+		content = f.read()
+
+	# header lines ("Type: all", "Encoding: msgpack") in front of the data.
+	headers = {}
+	while True:
+		line, newline, rest = content.partition(b'\n')
+		key, colon, value = line.partition(b': ')
+		if not newline or not colon or key not in HEADERS:
+			break
+		headers[key.decode('utf-8')] = value.decode('utf-8').strip()
+		content = rest
+
+	return headers.get('Type'), decodeResult(content, headers.get('Encoding', 'json'))
+
+def readArchived(archive, entry):
+	"""Returns the plan type and the result of the archive entry."""
+	return entry.planType, decodeResult(archive.load(entry), entry.encoding)
+
+def parseTime(value):
+	"""Parses "YYYY-MM-DD HH:MM[:SS]" or "HH:MM[:SS]" (today)."""
+	for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%H:%M:%S', '%H:%M']:
+		try:
+			t = datetime.strptime(value, fmt)
+		except ValueError:
+			continue
+		if '%Y' not in fmt:
+			t = datetime.combine(datetime.now().date(), t.time())
+		if '%S' not in fmt:
+			# "07:42" includes everything sent within that minute.
+			t = t.replace(second=59, microsecond=999999)
+		return t
+
+	raise ValueError('Unknown time format: %s' % (value,))
+
+def formatTime(timestamp):
+	return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+def main():
+	parser = argparse.ArgumentParser(description='Shows results saved with option "saveResult".')
+	parser.add_argument('--archive', default='results', help='result archive (option "resultPath")')
+	parser.add_argument('--list', action='store_true', help='lists the saved results')
+	parser.add_argument('--limit', type=int, default=50, help='number of results listed')
+	parser.add_argument('--at', help='result which was sent at that time')
+	parser.add_argument('--id', type=int, help='result with that id (see --list)')
+	parser.add_argument('file', nargs='?', help='vplan-result file of older versions')
+	parser.add_argument('output', nargs='?', help='JSON file to write (default: stdout)')
+	args = parser.parse_args()
+
+	archive = ResultArchive(args.archive)
+	if args.list:
+		for entry in archive.entries(limit=args.limit):
+			print('{:6d}  {:s}  {:<6s} {:<14s} {:<9s} {:<8s} {:s}'.format(
+				entry.id, formatTime(entry.created), entry.planType or '-', entry.handler or '-',
+				entry.status or '-', entry.encoding or '-', (entry.fingerprint or '-')[:16]
+			))
+		return
+
+	if args.at is not None or args.id is not None:
+		# the positional argument is the output file.
+		output = args.output or args.file
+		if args.id is not None:
+			entry = archive.get(args.id)
+		else:
+			entry = archive.find(parseTime(args.at).timestamp())
+		if entry is None:
+			print('No saved result found.')
+			sys.exit(1)
+		print('Result %d from %s (%s).' % (entry.id, formatTime(entry.created), entry.status), file=sys.stderr)
+		planType, table = readArchived(archive, entry)
+	elif args.file is not None:
+		output = args.output
+		planType, table = readResult(args.file)
+	else:
+		parser.print_usage()
+		sys.exit(1)
+
+	content = json.dumps(table, indent=2, ensure_ascii=False)
+	if output:
+		with open(output, 'w', encoding='utf-8') as f:
+			f.write(content)
+		print('Plan of type %s with %d entries written to %s.' % (planType, len(table.get('plan', [])), output))
+	else:
+		print(content)
+
+if __name__ == '__main__':
+	main()
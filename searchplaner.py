@@ -1,20 +1,171 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-#
-# @author Lukas Schreiner
-# @file searchplaner.py
-
-import time, os
-
-class SearchPlaner:
-	plan = None
-
-	def __init__(self, plan):
-		self.plan = plan
-		self.loopSearch()
-	
-	def loopSearch(self):
-		while self.plan.getRun():
-			time.sleep(self.plan.getIntervall())
-			if self.plan.getStatus() == False:
-				self.plan.getNewFiles()
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file searchplaner.py
+
+import time, os
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify constants (see <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+class SearchPlaner:
+	"""Polling backend: looks every intervall seconds for new files."""
+	plan = None
+
+	def __init__(self, plan):
+		self.plan = plan
+		self.loopSearch()
+
+	def loopSearch(self):
+		while self.plan.getRun():
+			time.sleep(self.plan.getIntervall())
+			if self.plan.getStatus() == False:
+				self.plan.getNewFiles()
+
+class InotifySearchPlaner(SearchPlaner):
+	"""Event driven backend based on inotify (Linux only).
+
+	getNewFiles is only called if a file in the watch path was closed after
+	writing, moved into or out of it or deleted (also by ourselves after the
+	upload - otherwise the next identical export looks unchanged), or while
+	files are waiting to settle. The
+	intervall is used as timeout to check whether we should still run.
+	"""
+
+	EVENT_HEADER = struct.Struct('iIII')
+	CHANGE_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+	WATCH_MASK = CHANGE_MASK | IN_DELETE_SELF | IN_MOVE_SELF
+
+	def __init__(self, plan):
+		self._libc = None
+		self._fd = None
+		self._wd = None
+		super().__init__(plan)
+
+	@staticmethod
+	def isSupported():
+		if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+			return False
+
+		libName = ctypes.util.find_library('c')
+		try:
+			libc = ctypes.CDLL(libName, use_errno=True)
+		except OSError:
+			return False
+
+		return hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch')
+
+	def _open(self):
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self._fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+
+	def _addWatch(self):
+		pathToWatch = self.plan.getWatchPath()
+		if not os.path.exists(pathToWatch):
+			try:
+				os.makedirs(pathToWatch)
+			except:
+				pass
+
+		self._wd = self._libc.inotify_add_watch(
+			self._fd, os.fsencode(pathToWatch), self.WATCH_MASK
+		)
+		if self._wd < 0:
+			self._wd = None
+			return False
+
+		return True
+
+	def _close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+			self._wd = None
+
+	def readEvents(self):
+		"""Reads all pending events and returns whether one of them is relevant."""
+		relevant = False
+		lostWatch = False
+		try:
+			buf = os.read(self._fd, 64 * 1024)
+		except BlockingIOError:
+			return False, False
+
+		offset = 0
+		while offset + self.EVENT_HEADER.size <= len(buf):
+			wd, mask, cookie, nameLen = self.EVENT_HEADER.unpack_from(buf, offset)
+			offset += self.EVENT_HEADER.size + nameLen
+			if mask & (self.CHANGE_MASK | IN_Q_OVERFLOW):
+				relevant = True
+			if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+				lostWatch = True
+
+		return relevant, lostWatch
+
+	def loopSearch(self):
+		try:
+			self._open()
+		except OSError as e:
+			print('inotify not available (%s) - fall back to polling.' % (str(e),))
+			return super().loopSearch()
+
+		try:
+			self._addWatch()
+			# catch up with everything that happend before we were watching.
+			pending = True
+			while self.plan.getRun():
+				if pending and self.plan.getStatus() == False:
+					self.plan.getNewFiles()
+					# files which are still written are checked again shortly.
+					pending = self.plan.hasPendingFiles()
+
+				if self._wd is None:
+					# directory is gone. Retry until it is back.
+					time.sleep(self.plan.getIntervall())
+					pending = self._addWatch()
+					continue
+
+				# while the plan is locked, we check again shortly.
+				timeout = min(0.5, self.plan.getIntervall()) if pending else self.plan.getIntervall()
+				readable, _, _ = select.select([self._fd], [], [], timeout)
+				if not readable:
+					continue
+
+				relevant, lostWatch = self.readEvents()
+				pending = pending or relevant or lostWatch
+				if lostWatch:
+					self._wd = None
+		finally:
+			self._close()
+
+def createSearchPlaner(plan):
+	"""Starts the watcher backend configured for the given plan.
+
+	The backend can be choosen with option "watcher" in section "default":
+	"poll", "inotify" or "auto" (inotify if available, otherwise polling).
+	"""
+	backend = plan.getWatcher()
+	if backend in ['auto', 'inotify'] and InotifySearchPlaner.isSupported():
+		return InotifySearchPlaner(plan)
+
+	if backend == 'inotify':
+		print('inotify is not supported on this system - fall back to polling.')
+
+	return SearchPlaner(plan)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file uploader.py
+
+import base64
+import gzip
+import threading
+import zlib
+import urllib.parse
+import requests
+import payload
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+class Uploader(object):
+	"""Long-living HTTP client used to upload the plans to one target.
+
+	The connections are kept alive (also through the proxy) and every request
+	has a connect and read timeout. Settings are read from section "http".
+
+	Every section "target-<name>" defines an upload target. It needs "url" and
+	"api" and may override the options of section "http" as well as "proxy"
+	("host:port" or "False") and "username"/"password" for the basic auth.
+	Without any target section, "url" and "api" of section "default" are used.
+
+	The plan is sent as (option "format"):
+	 - form: base64 encoded JSON in an urlencoded form (legacy)
+	 - gzip/zstd: compressed JSON as request body, API key and plan type
+	   are sent as header.
+
+	Instead of bytes, the plan can be given as iterable of chunks (see
+	payload.JSONStream). The body is then encoded on the fly and sent with
+	chunked transfer encoding.
+
+	Large plans can be split (option "shard": "date" or "count") into several
+	requests of type "shard" which are completed by a request of type
+	"commit" (see payload.buildShard/buildCommit).
+
+	With "conditionalMasterData" the master data sections the server already
+	acknowledged are left out of full uploads (see payload.stripMasterData).
+
+	With "layout" set to "columns", the rows of the plan are sent column by
+	column (see payload.encodeColumns). Option "encoding" selects JSON,
+	MessagePack ("msgpack") or CBOR ("cbor") for the plan data.
+	"""
+
+	FORMATS = ['form', 'gzip', 'zstd']
+	SHARD_MODES = ['none', 'date', 'count']
+	LAYOUTS = ['rows', 'columns']
+
+	def __init__(self, config, name='default', section=None):
+		self.config = config
+		self.name = name
+		self.section = section
+		self.lock = threading.Lock()
+		self._session = None
+
+	@classmethod
+	def fromConfig(cls, config):
+		"""Returns an uploader for every configured target."""
+		uploaders = []
+		for section in config.sections():
+			if section.startswith('target-'):
+				uploaders.append(cls(config, section[len('target-'):], section))
+
+		if not uploaders:
+			uploaders.append(cls(config))
+
+		return uploaders
+
+	def _get(self, option, globalSection='http', fallback=None):
+		if self.section and self.config.has_option(self.section, option):
+			return self.config.get(self.section, option)
+
+		return self.config.get(globalSection, option, fallback=fallback)
+
+	def _getboolean(self, option, fallback=False):
+		value = self._get(option)
+		return fallback if value is None else value.strip().lower() in ['true', 'yes', 'on', '1']
+
+	def _getint(self, option, fallback=0):
+		value = self._get(option)
+		return fallback if value is None else int(value)
+
+	def _getfloat(self, option, fallback=0.0):
+		value = self._get(option)
+		return fallback if value is None else float(value)
+
+	def getURL(self):
+		return self._get('url', 'default')
+
+	def getAPIKey(self):
+		return self._get('api', 'default')
+
+	def getProxy(self):
+		if self.section and self.config.has_option(self.section, 'proxy'):
+			proxy = self.config.get(self.section, 'proxy').strip()
+			if not proxy or proxy == 'False':
+				return None
+			return proxy if '://' in proxy else 'http://' + proxy
+
+		if not self.config.getboolean('proxy', 'enable', fallback=False):
+			return None
+
+		return "http://"+self.config.get("proxy", "phost")+":"+self.config.get("proxy", "pport")
+
+	def getAuth(self):
+		if self.section and self.config.has_option(self.section, 'username'):
+			return HTTPBasicAuth(
+				self.config.get(self.section, 'username'),
+				self.config.get(self.section, 'password', fallback='')
+			)
+
+		if not self.config.getboolean('siteauth', 'enable', fallback=False):
+			return None
+
+		return HTTPBasicAuth(
+			self.config.get('siteauth', 'username'),
+			self.config.get('siteauth', 'password')
+		)
+
+	def getTimeout(self):
+		return (
+			self._getfloat('connectTimeout', fallback=10.0),
+			self._getfloat('readTimeout', fallback=120.0)
+		)
+
+	def getFormat(self):
+		fmt = self._get('format', fallback='form').lower()
+		if fmt not in Uploader.FORMATS:
+			print('Unknown upload format "%s" - using form.' % (fmt,))
+			fmt = 'form'
+		elif fmt == 'zstd' and zstandard is None:
+			print('zstandard is not installed - using gzip.')
+			fmt = 'gzip'
+
+		return fmt
+
+	def skipUnchanged(self):
+		return self._getboolean('skipUnchanged', fallback=True)
+
+	def useDelta(self):
+		return self._getboolean('delta', fallback=False)
+
+	def getDeltaFullPolicy(self):
+		"""Returns after how many deltas / seconds a full upload is sent again."""
+		return (
+			self._getint('deltaFullEvery', fallback=20),
+			self._getint('deltaFullInterval', fallback=21600)
+		)
+
+	def conditionalMasterData(self):
+		return self._getboolean('conditionalMasterData', fallback=False)
+
+	def getMasterDataInterval(self):
+		"""Returns after how many seconds the complete master data is sent again."""
+		return self._getint('masterDataInterval', fallback=86400)
+
+	def getLayout(self):
+		layout = self._get('layout', fallback='rows').lower()
+		if layout not in Uploader.LAYOUTS:
+			print('Unknown plan layout "%s" - using rows.' % (layout,))
+			layout = 'rows'
+
+		return layout
+
+	def getEncoding(self):
+		encoding = self._get('encoding', fallback='json').lower()
+		if encoding not in payload.ENCODINGS:
+			print('Unknown encoding "%s" - using json.' % (encoding,))
+			encoding = 'json'
+		elif not payload.isEncodingAvailable(encoding):
+			print('%s is not installed - using json.' % ('msgpack' if encoding == 'msgpack' else 'cbor2',))
+			encoding = 'json'
+
+		return encoding
+
+	def getShardMode(self):
+		mode = self._get('shard', fallback='none').lower()
+		if mode not in Uploader.SHARD_MODES:
+			print('Unknown shard mode "%s" - plans are not split.' % (mode,))
+			mode = 'none'
+
+		return mode
+
+	def getShardSize(self):
+		return self._getint('shardSize', fallback=2000)
+
+	def getShardRetries(self):
+		return self._getint('shardRetries', fallback=2)
+
+	def compress(self, data, fmt):
+		if fmt == 'zstd':
+			level = self._getint('compressLevel', fallback=3)
+			return zstandard.ZstdCompressor(level=level).compress(data)
+		else:
+			level = self._getint('compressLevel', fallback=6)
+			return gzip.compress(data, compresslevel=level)
+
+	def compressStream(self, chunks, fmt):
+		if fmt == 'zstd':
+			compressor = zstandard.ZstdCompressor(level=self._getint('compressLevel', fallback=3)).compressobj()
+		else:
+			compressor = zlib.compressobj(self._getint('compressLevel', fallback=6), zlib.DEFLATED, 31)
+
+		for chunk in chunks:
+			data = compressor.compress(chunk)
+			if data:
+				yield data
+
+		yield compressor.flush()
+
+	def formStream(self, chunks, values):
+		"""Encodes the chunks like urlencode() does with the base64 encoded "data"."""
+		yield (urllib.parse.urlencode(values) + '&data=').encode('utf-8')
+		rest = b''
+		for chunk in chunks:
+			chunk = rest + chunk
+			# base64 needs blocks of 3 bytes - otherwise there is padding in between.
+			cut = len(chunk) - len(chunk) % 3
+			rest = chunk[cut:]
+			if cut > 0:
+				yield urllib.parse.quote_plus(base64.b64encode(chunk[:cut])).encode('utf-8')
+
+		if rest:
+			yield urllib.parse.quote_plus(base64.b64encode(rest)).encode('utf-8')
+
+	def encodeBody(self, data, planType, apiKey, debug=False, encoding='json'):
+		"""Returns the request body and headers for the encoded plan data.
+
+		If data is not bytes but an iterable of chunks, the body is a generator.
+		"""
+		encApiKey = base64.b64encode(apiKey.encode('utf-8')).decode('utf-8').replace('\n', '')
+		fmt = self.getFormat()
+		streaming = not isinstance(data, bytes)
+		if fmt == 'form' and streaming:
+			values = {
+				'apikey': encApiKey,
+				'type': planType
+			}
+			if encoding != 'json':
+				values['encoding'] = encoding
+			if debug:
+				values['XDEBUG_SESSION_START'] = '1'
+			headers = {'Content-Type': 'application/x-www-form-urlencoded;charset=utf-8'}
+			return self.formStream(data, values), headers
+		elif fmt == 'form':
+			values = {
+				'apikey': encApiKey,
+				'data': base64.b64encode(data).decode('utf-8').replace('\n', ''),
+				'type': planType
+			}
+			if encoding != 'json':
+				values['encoding'] = encoding
+			if debug:
+				values['XDEBUG_SESSION_START'] = '1'
+			headers = {'Content-Type': 'application/x-www-form-urlencoded;charset=utf-8'}
+			return urllib.parse.urlencode(values), headers
+
+		headers = {
+			'Content-Type': payload.ENCODINGS[encoding],
+			'Content-Encoding': fmt,
+			'X-Api-Key': encApiKey,
+			'X-Plan-Type': planType
+		}
+		if debug:
+			headers['Cookie'] = 'XDEBUG_SESSION=1'
+		if streaming:
+			return self.compressStream(data, fmt), headers
+		return self.compress(data, fmt), headers
+
+	@property
+	def session(self):
+		if self._session is None:
+			poolSize = self._getint('poolSize', fallback=2)
+			adapter = HTTPAdapter(
+				pool_connections=poolSize,
+				pool_maxsize=poolSize,
+				max_retries=self._getint('retries', fallback=0)
+			)
+			session = requests.Session()
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			httpproxy = self.getProxy()
+			if httpproxy:
+				session.proxies = {
+					"http" : httpproxy,
+					"https": httpproxy
+				}
+			session.auth = self.getAuth()
+			self._session = session
+
+		return self._session
+
+	def post(self, url, **kwargs):
+		kwargs.setdefault('timeout', self.getTimeout())
+		return self.session.post(url, **kwargs)
+
+	def close(self):
+		if self._session is not None:
+			self._session.close()
+			self._session = None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file uploadstate.py
+
+import os
+import json
+import time
+import uuid
+import threading
+import payload
+
+class UploadState(object):
+	"""Remembers per endpoint what the server acknowledged last.
+
+	The state is saved as JSON file and survives restarts.
+	"""
+
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.endpoints = {}
+		self._lock = threading.Lock()
+
+	def load(self):
+		try:
+			with open(self.fileName, 'r', encoding='utf-8') as f:
+				self.endpoints = json.load(f)
+		except FileNotFoundError:
+			self.endpoints = {}
+		except ValueError as e:
+			print('Upload state %s is damaged (%s) - start with an empty one.' % (self.fileName, str(e)))
+			self.endpoints = {}
+
+	def save(self):
+		with self._lock:
+			dirName = os.path.dirname(self.fileName)
+			if dirName and not os.path.exists(dirName):
+				os.makedirs(dirName)
+
+			tmpName = '{:s}.tmp'.format(self.fileName)
+			with open(tmpName, 'w', encoding='utf-8') as f:
+				json.dump(self.endpoints, f)
+			os.replace(tmpName, self.fileName)
+
+	def get(self, endpoint):
+		with self._lock:
+			try:
+				return self.endpoints[endpoint]
+			except KeyError:
+				state = {
+					'guids': None,
+					'hashes': {},
+					'lastFull': 0,
+					'lastMasterData': 0,
+					'deltas': 0,
+					'fingerprint': None,
+					'batch': None
+				}
+				self.endpoints[endpoint] = state
+				return state
+
+	def reset(self, endpoint):
+		with self._lock:
+			try:
+				del(self.endpoints[endpoint])
+			except KeyError:
+				pass
+
+	def isDeltaAllowed(self, endpoint, fullEvery, fullInterval):
+		"""Checks whether a delta can be sent or a full upload is due."""
+		state = self.get(endpoint)
+		if state['guids'] is None:
+			return False
+		elif fullEvery > 0 and state['deltas'] >= fullEvery:
+			return False
+		elif fullInterval > 0 and time.time() - state['lastFull'] >= fullInterval:
+			return False
+
+		return True
+
+	def isMasterDataKnown(self, endpoint, interval):
+		"""Checks whether unchanged master data can be left out or a complete upload is due."""
+		state = self.get(endpoint)
+		if not state['hashes']:
+			return False
+		elif interval > 0 and time.time() - state.get('lastMasterData', 0) >= interval:
+			return False
+
+		return True
+
+	def isUnchanged(self, endpoint, fingerprint):
+		return self.get(endpoint).get('fingerprint') == fingerprint
+
+	def getBatch(self, endpoint, fingerprint, shards):
+		"""Returns the unfinished batch of the same plan or starts a new one."""
+		state = self.get(endpoint)
+		with self._lock:
+			batch = state.get('batch')
+			if batch is None or fingerprint is None or \
+				batch['fingerprint'] != fingerprint or batch['shards'] != shards:
+				batch = {
+					'id': uuid.uuid4().hex,
+					'fingerprint': fingerprint,
+					'shards': shards,
+					'sent': []
+				}
+				state['batch'] = batch
+
+			return batch
+
+	def shardSent(self, endpoint, seq):
+		state = self.get(endpoint)
+		with self._lock:
+			state['batch']['sent'].append(seq)
+
+	def acknowledge(self, endpoint, table, full=True, fingerprint=None, masterData=True):
+		"""Saves the GUIDs, hashes and fingerprint of an uploaded plan.
+
+		masterData tells whether all master data was part of the upload.
+		"""
+		state = self.get(endpoint)
+		with self._lock:
+			state['batch'] = None
+			if masterData:
+				state['lastMasterData'] = int(time.time())
+			state['fingerprint'] = fingerprint
+			state['guids'] = sorted(set(payload.planGuids(table['plan'])))
+			state['hashes'] = dict(table.get('hashes', {}))
+			if full:
+				state['lastFull'] = int(time.time())
+				state['deltas'] = 0
+			else:
+				state['deltas'] += 1
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file watchfile.py
+
+import os
+import fnmatch
+import hashlib
+import time
+
+class WatchFile(object):
+	"""A file which is or was watched in order to retrieve information"""
+
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(self, path, fname, stInfo=None):
+		self.path = path
+		self.name = fname
+
+		if stInfo is None:
+			stInfo = os.stat(self.getFullName)
+		self.mtime = stInfo.st_mtime
+		self.atime = stInfo.st_atime
+		self.size = stInfo.st_size
+		self._fingerprint = None
+
+	@property
+	def getFullName(self):
+		return '%s/%s' % (self.path, self.name)
+
+	@property
+	def fingerprint(self):
+		"""Hash of the file content (computed once per file version)."""
+		if self._fingerprint is None:
+			h = hashlib.blake2b(digest_size=16)
+			try:
+				with open(self.getFullName, 'rb') as f:
+					for chunk in iter(lambda: f.read(WatchFile.CHUNK_SIZE), b''):
+						h.update(chunk)
+			except OSError:
+				return None
+			self._fingerprint = h.hexdigest()
+
+		return self._fingerprint
+
+	def isModified(self, other):
+		return self.size != other.size or self.mtime != other.mtime
+
+	def isChanged(self, other, useFingerprint=True):
+		"""Checks whether the content differs from the older version other."""
+		if self.size != other.size:
+			return True
+		elif self.mtime == other.mtime:
+			return False
+		elif not useFingerprint:
+			return True
+
+		# only touched?
+		oldPrint = other._fingerprint
+		return oldPrint is None or self.fingerprint != oldPrint
+
+class DirectorySnapshot(dict):
+	"""All watched files of a directory, build with a single scandir pass.
+
+	Directories (e.g. the backup folder) and files matching one of the
+	ignore patterns are skipped.
+	"""
+
+	def __init__(self, path, ignore=None):
+		super().__init__()
+		self.path = path
+		self.ignore = ignore or []
+
+	def isIgnored(self, fname):
+		for pattern in self.ignore:
+			if fnmatch.fnmatch(fname, pattern):
+				return True
+
+		return False
+
+	@classmethod
+	def scan(cls, path, ignore=None):
+		self = cls(path, ignore)
+		with os.scandir(path) as it:
+			for entry in it:
+				if self.isIgnored(entry.name):
+					continue
+
+				try:
+					if not entry.is_file():
+						continue
+					self[entry.name] = WatchFile(path, entry.name, entry.stat())
+				except FileNotFoundError:
+					# removed in the meantime.
+					continue
+
+		return self
+
+	def fingerprintAll(self):
+		for wf in self.values():
+			wf.fingerprint
+
+	def compare(self, before, useFingerprint=True):
+		"""Compares with the older snapshot and returns (added, removed, changed).
+
+		Files which are unchanged take over the older WatchFile in order to
+		keep an already computed fingerprint.
+		"""
+		added = []
+		changed = []
+		for f, wf in self.items():
+			try:
+				old = before[f]
+			except KeyError:
+				added.append(f)
+				if useFingerprint:
+					wf.fingerprint
+				continue
+
+			if not wf.isModified(old):
+				self[f] = old
+			elif wf.isChanged(old, useFingerprint):
+				changed.append(f)
+				if useFingerprint:
+					wf.fingerprint
+			else:
+				print('"%s" was touched, but the content is unchanged.' % (f,))
+
+		removed = [f for f in before if f not in self]
+		return added, removed, changed
+
+class StabilityTracker(object):
+	"""Holds back files until they are not written anymore.
+
+	A file is handed off once its size and mtime did not change for
+	settleTime seconds. A file which was written completely and then renamed
+	into the watch path already has an old mtime and is handed off at once.
+	Pending files which disappear (e.g. temporary files being renamed) are
+	dropped.
+	"""
+
+	def __init__(self, settleTime=0.0):
+		self.settleTime = settleTime
+		self._pending = {}
+
+	def hasPending(self):
+		return len(self._pending) > 0
+
+	def hold(self, wf, now=None):
+		now = time.time() if now is None else now
+		try:
+			size, mtime, since = self._pending[wf.name]
+		except KeyError:
+			self._pending[wf.name] = (wf.size, wf.mtime, now)
+		else:
+			if size != wf.size or mtime != wf.mtime:
+				self._pending[wf.name] = (wf.size, wf.mtime, now)
+
+	def isSettled(self, wf, now=None):
+		now = time.time() if now is None else now
+		if now - wf.mtime >= self.settleTime:
+			return True
+
+		try:
+			size, mtime, since = self._pending[wf.name]
+		except KeyError:
+			return False
+
+		return size == wf.size and mtime == wf.mtime and now - since >= self.settleTime
+
+	def update(self, snapshot, candidates, now=None):
+		"""Adds the candidates and returns all pending files which are settled now."""
+		now = time.time() if now is None else now
+		for f in candidates:
+			self.hold(snapshot[f], now)
+
+		ready = []
+		for f in list(self._pending.keys()):
+			try:
+				wf = snapshot[f]
+			except KeyError:
+				del(self._pending[f])
+				continue
+
+			self.hold(wf, now)
+			if self.isSettled(wf, now):
+				del(self._pending[f])
+				ready.append(f)
+
+		return ready
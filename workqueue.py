@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# @author Lukas Schreiner
+# @file workqueue.py
+
+import threading
+import collections
+
+class CoalescingQueue(object):
+	"""Keyed work queue.
+
+	If an item is put for a key which is still pending, the older item is
+	replaced by the newer one (at its old position). This way only the newest
+	version of a file (or file set) is processed.
+	"""
+
+	def __init__(self):
+		self._cond = threading.Condition()
+		self._items = collections.OrderedDict()
+		self.enqueued = 0
+		self.coalesced = 0
+		self.processed = 0
+
+	def __len__(self):
+		with self._cond:
+			return len(self._items)
+
+	def put(self, key, item):
+		"""Adds the item and returns whether a pending one was replaced."""
+		with self._cond:
+			replaced = key in self._items
+			self._items[key] = item
+			self.enqueued += 1
+			if replaced:
+				self.coalesced += 1
+			self._cond.notify()
+
+		return replaced
+
+	def get(self, timeout=None):
+		"""Returns the oldest (key, item) pair or None if nothing came within timeout."""
+		with self._cond:
+			if not self._items:
+				self._cond.wait(timeout)
+			if not self._items:
+				return None
+
+			self.processed += 1
+			return self._items.popitem(last=False)
+
+	def stats(self):
+		with self._cond:
+			return {
+				'depth': len(self._items),
+				'enqueued': self.enqueued,
+				'coalesced': self.coalesced,
+				'processed': self.processed
+			}